@@ -0,0 +1,131 @@
+# benchmark of the API under concurrent requests: runs the app in one or
+# several (--processes) processes, then measures the throughput of status requests with an
+# increasing number of concurrent clients, and their latency while large
+# plans are being submitted at the same time
+#
+# run with: PYTHONPATH=. python benchmarks/api.py --config=config.yaml
+#
+# it runs against the `<database>_test` database (see utils/db_init.py),
+# whose tables are dropped and recreated
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
+from tornado.httpclient import AsyncHTTPClient
+
+from common import load_test_env, make_plan, reset_database
+
+parser = argparse.ArgumentParser(description="Benchmark the API.")
+parser.add_argument(
+    "--concurrency",
+    type=int,
+    nargs="+",
+    default=[1, 4, 16],
+    help="numbers of concurrent clients",
+)
+parser.add_argument("--requests", type=int, default=500, help="status requests per run")
+parser.add_argument(
+    "--targets", type=int, default=20000, help="targets of the plans submitted"
+)
+parser.add_argument(
+    "--processes", type=int, default=1, help="processes serving the app"
+)
+parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+args, _ = parser.parse_known_args()
+
+env, cfg = load_test_env()
+
+from skyportal_mma_facility.app_server import make_app
+
+
+async def status_requests(client, url, n, concurrency):
+    """Send `n` status requests, `concurrency` at a time, and return their
+    latencies in seconds."""
+    latencies = []
+    remaining = iter(range(n))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            await client.fetch(url)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies
+
+
+async def main():
+    make_app(cfg)
+    reset_database()
+
+    port = tornado.netutil.bind_sockets(0, "127.0.0.1")[0].getsockname()[1]
+    # in its own process group, to stop the forked processes with it
+    server = subprocess.Popen(
+        [sys.executable, __file__, f"--serve={port}", *sys.argv[1:]],
+        start_new_session=True,
+    )
+    base = f"http://127.0.0.1:{port}/api"
+    client = AsyncHTTPClient(max_clients=max(args.concurrency) + 4)
+    try:
+        for _ in range(100):
+            try:
+                response = await client.fetch(
+                    f"{base}/obsplans", method="PUT", body=json.dumps(make_plan(1))
+                )
+                break
+            except (ConnectionError, OSError):
+                await asyncio.sleep(0.1)
+        plan_id = json.loads(response.body)["data"]["id"]
+        url = f"{base}/obsplans/{plan_id}?fields=id,status"
+
+        print("status requests:")
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            latencies = await status_requests(client, url, args.requests, concurrency)
+            duration = time.perf_counter() - start
+            print(
+                f"  {concurrency:>3} clients: {args.requests / duration:>8.0f} req/s, "
+                f"p50 {np.percentile(latencies, 50) * 1000:.1f} ms"
+            )
+
+        print(f"status requests while submitting plans of {args.targets} targets:")
+        bodies = [json.dumps(make_plan(args.targets)) for _ in range(4)]
+        submissions = asyncio.gather(
+            *[
+                client.fetch(
+                    f"{base}/obsplans", method="PUT", body=body, request_timeout=300
+                )
+                for body in bodies
+            ]
+        )
+        latencies = await status_requests(client, url, args.requests, 1)
+        await submissions
+        print(
+            f"    1 client:  p50 {np.percentile(latencies, 50) * 1000:.1f} ms, "
+            f"max {np.max(latencies) * 1000:.1f} ms"
+        )
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+if args.serve is not None:
+    sockets = tornado.netutil.bind_sockets(args.serve, address="127.0.0.1")
+    if args.processes > 1:
+        tornado.process.fork_processes(args.processes)
+    server = tornado.httpserver.HTTPServer(make_app(cfg, processes=args.processes))
+    server.add_sockets(sockets)
+    tornado.ioloop.IOLoop.current().start()
+else:
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+# fixtures shared by the benchmarks: they run against the `<database>_test`
+# database (see utils/db_init.py), whose tables they drop and recreate
+#
+# the benchmarks import it as `common`, the folder of the script being run
+# being on the path
+
+import uuid
+
+from astropy.time import Time
+
+from skyportal_mma_facility.utils.env import load_env
+
+
+def load_test_env():
+    """Load the configuration, pointed to the `<database>_test` database.
+
+    It must be called before importing the modules of the app, as some of
+    them read the configuration when imported.
+
+    Returns
+    -------
+    env, cfg
+        The environment and the configuration, as returned by `load_env`.
+    """
+    env, cfg = load_env()
+    if not cfg["database.database"].endswith("_test"):
+        cfg["database"]["database"] = f"{cfg['database.database']}_test"
+    return env, cfg
+
+
+def make_plan(targets, filters=("ztfg",), rng=None, start=0.0):
+    """Make an observation plan, as submitted by SkyPortal.
+
+    Parameters
+    ----------
+    targets : int
+        Number of targets of the plan.
+    filters : sequence of str, optional
+        Filters the targets are observed with, in turn.
+    rng : numpy.random.Generator, optional
+        Generator of the positions of the targets, spread over the sky.
+        Without it, the targets are all at the same position.
+    start : float, optional
+        Start of the validity window of the plan, in days from now. It lasts
+        a day.
+
+    Returns
+    -------
+    dict
+        The plan, with a random queue name.
+    """
+    now = Time.now().mjd
+    if rng is None:
+        ra = dec = [10.0] * targets
+    else:
+        ra = rng.uniform(0, 360, targets).tolist()
+        dec = rng.uniform(-30, 90, targets).tolist()
+    return {
+        "queue_name": str(uuid.uuid4()),
+        "user": "benchmark",
+        "validity_window_mjd": [now + start, now + start + 1],
+        "queue_type": "list",
+        "targets": [
+            {
+                "request_id": i,
+                "field_id": i,
+                "ra": ra[i],
+                "dec": dec[i],
+                "filter": filters[i % len(filters)],
+                "exposure_time": 30,
+                "program_pi": "benchmark",
+            }
+            for i in range(targets)
+        ],
+    }
+
+
+def reset_database(filters=("ztfg",)):
+    """Drop and recreate the tables, then add a telescope with an instrument.
+
+    The app must have been made, for the database to be initialized. The
+    instrument is the first one, which the plans submitted through the API
+    are on.
+
+    Parameters
+    ----------
+    filters : sequence of str, optional
+        Filters of the instrument.
+
+    Returns
+    -------
+    int
+        ID of the instrument.
+    """
+    from skyportal_mma_facility.models import DBSession, Instrument, Telescope
+    from skyportal_mma_facility.utils.model_util import create_tables, drop_tables
+
+    drop_tables()
+    create_tables()
+    with DBSession() as session:
+        telescope = Telescope(
+            name="benchmark", nickname="benchmark", diameter=1.0, robotic=True
+        )
+        session.add(telescope)
+        session.flush()
+        instrument = Instrument(
+            name="benchmark",
+            type="imager",
+            band="optical",
+            filters=list(filters),
+            telescope_id=telescope.id,
+        )
+        session.add(instrument)
+        session.commit()
+        return instrument.id
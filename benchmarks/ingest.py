@@ -0,0 +1,85 @@
+# benchmark of the ingestion of observation plans: times the insertion of
+# plans of increasing size, with one ORM object per target (as the API used
+# to do), with multi-row INSERTs, and with COPY
+#
+# run with: PYTHONPATH=. python benchmarks/ingest.py --config=config.yaml
+#
+# it runs against the `<database>_test` database (see utils/db_init.py),
+# whose tables are dropped and recreated
+
+import argparse
+import time
+
+import numpy as np
+
+from common import load_test_env, make_plan, reset_database
+
+parser = argparse.ArgumentParser(description="Benchmark the ingestion of plans.")
+parser.add_argument(
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[10, 100, 1000, 10000],
+    help="number of targets of the plans",
+)
+parser.add_argument("--repeat", type=int, default=3, help="plans per size and method")
+args, _ = parser.parse_known_args()
+
+env, cfg = load_test_env()
+
+from skyportal_mma_facility.app_server import make_app
+from skyportal_mma_facility.handlers.api.obsplan import (
+    insert_observation_plan,
+    target_columns,
+)
+from skyportal_mma_facility.models import DBSession, Observation
+
+filters = ["ztfg", "ztfr", "ztfi"]
+rng = np.random.default_rng()
+
+
+def insert_orm(session, data, instrument_id):
+    """Insert the targets one ORM object at a time, for reference."""
+    observation_plan_id = insert_observation_plan(
+        session, {**data, "targets": []}, instrument_id
+    )
+    for target in data["targets"]:
+        session.add(
+            Observation(
+                **{column: target[column] for column in target_columns},
+                observation_plan_id=observation_plan_id,
+                instrument_id=instrument_id,
+            )
+        )
+    return observation_plan_id
+
+
+methods = {
+    "orm": insert_orm,
+    "insert": lambda session, data, instrument_id: insert_observation_plan(
+        session, data, instrument_id, copy=False
+    ),
+    "copy": lambda session, data, instrument_id: insert_observation_plan(
+        session, data, instrument_id, copy=True
+    ),
+}
+
+make_app(cfg)
+instrument_id = reset_database(filters)
+
+print(f"{'targets':>8}" + "".join(f"{method + ' (ms)':>14}" for method in methods))
+for size in args.sizes:
+    durations = {}
+    for method, insert in methods.items():
+        durations[method] = []
+        for _ in range(args.repeat):
+            data = {**make_plan(size, filters, rng), "status": "pending"}
+            with DBSession() as session:
+                start = time.perf_counter()
+                insert(session, data, instrument_id)
+                session.commit()
+                durations[method].append(time.perf_counter() - start)
+    print(
+        f"{size:>8}"
+        + "".join(f"{np.median(durations[method]) * 1000:>14.1f}" for method in methods)
+    )
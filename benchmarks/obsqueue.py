@@ -0,0 +1,217 @@
+# benchmark of the observation queue: submits observation plans through
+# /api/obsplans, runs them on a facility that takes no time, and writes
+# the latencies and throughput that were measured to a JSON file, in the
+# git-ignored benchmarks/results/ by default
+#
+# run with: make benchmark, or PYTHONPATH=. python benchmarks/obsqueue.py --config=config.yaml
+#
+# it runs against the `<database>_test` database (see utils/db_init.py),
+# whose tables are dropped and recreated
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+import tornado.httpserver
+import tornado.netutil
+from tornado.httpclient import AsyncHTTPClient
+
+from common import load_test_env, make_plan, reset_database
+
+parser = argparse.ArgumentParser(description="Benchmark the observation queue.")
+parser.add_argument("--plans", type=int, default=10, help="number of plans")
+parser.add_argument("--targets", type=int, default=100, help="targets per plan")
+parser.add_argument(
+    "--pickups", type=int, default=20, help="plans submitted to an idle queue"
+)
+parser.add_argument(
+    "--concurrency", type=int, default=1, help="observations run at the same time"
+)
+parser.add_argument(
+    "--output", default="benchmarks/results/obsqueue.json", help="JSON results file"
+)
+args, _ = parser.parse_known_args()
+
+env, cfg = load_test_env()
+cfg.setdefault("obsqueue", {})["concurrency"] = args.concurrency
+
+from skyportal_mma_facility.app_server import make_app
+from skyportal_mma_facility.facility import FacilityDriver
+from skyportal_mma_facility.models import DBSession, Instrument, Telescope
+from skyportal_mma_facility.queue_server import (
+    ObservationPlanQueue,
+    ObservationScheduler,
+)
+from skyportal_mma_facility.utils.profiling import QueryCounter, assert_max_queries
+
+filters = ["ztfg", "ztfr", "ztfi"]
+rng = np.random.default_rng()
+
+timings = {
+    "submit": [],
+    "pickup": [],
+    "load_plan": [],
+    "load_queue": [],
+    "processing": [],
+    "status_update": [],
+}
+pickups = {}
+completed = []
+
+
+class NullDriver(FacilityDriver):
+    """Facility performing observations instantly, without writing anything."""
+
+    async def observe(self, observation):
+        return self.path(observation)
+
+
+class BenchmarkQueue(ObservationPlanQueue):
+    """Lane recording the time spent in each step of the queue."""
+
+    async def load_plan(self):
+        start = time.perf_counter()
+        loaded_new_plan, timeout = await super().load_plan()
+        timings["load_plan"].append(time.perf_counter() - start)
+        if loaded_new_plan:
+            pickups[self._obsplan_id] = time.perf_counter()
+        return loaded_new_plan, timeout
+
+    async def load_queue(self):
+        start = time.perf_counter()
+        leased = await super().load_queue()
+        timings["load_queue"].append(time.perf_counter() - start)
+        return leased
+
+    async def processing(self, item):
+        start = time.perf_counter()
+        await super().processing(item)
+        timings["processing"].append(time.perf_counter() - start)
+
+    def release(self, session, item, status, values=None):
+        start = time.perf_counter()
+        super().release(session, item, status, values=values)
+        timings["status_update"].append(time.perf_counter() - start)
+
+    async def complete_plan(self):
+        await super().complete_plan()
+        completed.append(time.perf_counter())
+
+
+def statistics(values):
+    """Summary of durations in seconds, in milliseconds."""
+    if len(values) == 0:
+        return None
+    values = np.array(values) * 1000
+    return {
+        "count": len(values),
+        "mean": float(np.mean(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values)),
+    }
+
+
+async def submit(client, url, plan):
+    start = time.perf_counter()
+    response = await client.fetch(url, method="PUT", body=json.dumps(plan))
+    timings["submit"].append(time.perf_counter() - start)
+    return json.loads(response.body)["data"]["id"], start
+
+
+async def wait_for(condition, timeout=600):
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("The queue did not process the plans in time")
+        await asyncio.sleep(0.001)
+
+
+async def main():
+    app = make_app(cfg)
+    engine = DBSession.session_factory.kw["bind"]
+    reset_database(filters)
+    with DBSession() as session:
+        # telescopes without plans, so that listing the telescopes has to
+        # load the instruments of several of them
+        for i in range(3):
+            other = Telescope(
+                name=f"other {i}", nickname=f"other {i}", diameter=1.0, robotic=True
+            )
+            session.add(other)
+            session.flush()
+            session.add(
+                Instrument(
+                    name=f"other {i}",
+                    type="imager",
+                    band="optical",
+                    filters=["ztfg"],
+                    telescope_id=other.id,
+                )
+            )
+        session.commit()
+
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets(sockets)
+    url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/api/obsplans"
+    client = AsyncHTTPClient()
+
+    scheduler = ObservationScheduler(NullDriver("/dev/null"))
+    scheduler.lane_class = BenchmarkQueue
+
+    # throughput: submit all the plans, then drain them
+    for _ in range(args.plans):
+        plan_id, _ = await submit(
+            client, url, make_plan(args.targets, filters, rng, start=-0.01)
+        )
+
+    # the relationships are loaded with selectinload: listing the telescopes
+    # with their instruments, or getting a plan with its observations, takes
+    # two queries whatever their number
+    with assert_max_queries(engine, 2):
+        response = await client.fetch(url.replace("obsplans", "telescopes"))
+    telescopes = json.loads(response.body)["data"]
+    assert all(len(telescope.get("instruments", [])) == 1 for telescope in telescopes)
+    with assert_max_queries(engine, 2):
+        response = await client.fetch(f"{url}/{plan_id}")
+    plan = json.loads(response.body)["data"]
+    assert len(plan.get("observations", [])) == args.targets
+
+    observations = args.plans * args.targets
+    with QueryCounter(engine) as counter:
+        start = time.perf_counter()
+        scheduler.start(engine)
+        await wait_for(lambda: len(completed) >= args.plans)
+        duration = time.perf_counter() - start
+
+    # latency: submit plans one at a time to an idle queue
+    for _ in range(args.pickups):
+        plan_id, submitted_at = await submit(
+            client, url, make_plan(1, filters, rng, start=-0.01)
+        )
+        await wait_for(lambda: plan_id in pickups)
+        timings["pickup"].append(pickups[plan_id] - submitted_at)
+        n_completed = len(completed)
+        await wait_for(lambda: len(completed) > n_completed)
+
+    results = {
+        "parameters": vars(args),
+        "observations": observations,
+        "observations_per_second": observations / duration,
+        "db_round_trips_per_observation": counter.round_trips / observations,
+        "db_statements_per_observation": counter.statements / observations,
+        "latency_ms": {key: statistics(values) for key, values in timings.items()},
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    server.stop()
+
+
+asyncio.run(main())
@@ -0,0 +1,43 @@
+# compare the number of observation plans completed within their validity
+# window when running them first in, first out, or earliest deadline first,
+# on a synthetic workload of a single instrument
+#
+# run with: PYTHONPATH=. python benchmarks/scheduling.py --config=config.yaml
+
+import argparse
+
+import numpy as np
+
+from skyportal_mma_facility.utils.scheduling import simulate_deadlines
+
+parser = argparse.ArgumentParser(description="Compare plan scheduling policies.")
+parser.add_argument("--plans", type=int, default=200, help="number of plans")
+parser.add_argument(
+    "--duration", type=float, default=86400, help="submission period, in seconds"
+)
+parser.add_argument(
+    "--max-targets", type=int, default=20, help="maximum number of targets per plan"
+)
+parser.add_argument("--seed", type=int, default=0, help="random seed")
+args, _ = parser.parse_known_args()
+
+rng = np.random.default_rng(args.seed)
+
+arrivals = np.sort(rng.uniform(0, args.duration, args.plans))
+exposures = [
+    rng.choice([30, 60, 120, 300], rng.integers(1, args.max_targets + 1))
+    for _ in range(args.plans)
+]
+total_exposures = np.array([np.sum(e) for e in exposures])
+# windows range from barely enough to observe the plan (urgent plans,
+# e.g. for a fast transient) to several times the time needed
+deadlines = arrivals + total_exposures * rng.uniform(1, 10, args.plans)
+
+fifo = simulate_deadlines(arrivals, deadlines, exposures, policy="fifo")
+edf = simulate_deadlines(arrivals, deadlines, exposures, policy="edf")
+
+print(f"Plans:                           {args.plans}")
+print(f"Completed in time with FIFO:     {np.sum(fifo)}")
+print(f"Completed in time with EDF:      {np.sum(edf)}")
+print(f"Rescued by EDF:                  {np.sum(edf & ~fifo)}")
+print(f"Lost by EDF:                     {np.sum(fifo & ~edf)}")
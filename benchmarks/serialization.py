@@ -0,0 +1,81 @@
+# benchmark of the serialization of API responses: compares the indented
+# simplejson encoder (`to_json`) with the compact orjson one (`dumps`) on
+# a listing of observation plans and on the observations of a large plan
+#
+# run with: PYTHONPATH=. python benchmarks/serialization.py --config=config.yaml
+
+import argparse
+import time
+import uuid
+from datetime import datetime
+
+from skyportal_mma_facility.models import Observation, ObservationPlan
+from skyportal_mma_facility.utils.json_util import dumps, to_json
+
+parser = argparse.ArgumentParser(description="Benchmark the JSON serializers.")
+parser.add_argument("--plans", type=int, default=1000, help="plans in the listing")
+parser.add_argument(
+    "--observations", type=int, default=10000, help="observations of the plan"
+)
+parser.add_argument("--repeat", type=int, default=5, help="runs per serializer")
+args, _ = parser.parse_known_args()
+
+now = datetime.utcnow()
+plans = [
+    ObservationPlan(
+        id=i,
+        queue_name=str(uuid.uuid4()),
+        user="benchmark",
+        status="pending",
+        instrument_id=1,
+        validity_window_start=now,
+        validity_window_end=now,
+        overhead_saved=12.5,
+        created_at=now,
+        modified=now,
+    )
+    for i in range(args.plans)
+]
+observations = [
+    Observation(
+        id=i,
+        request_id=i,
+        field_id=i,
+        ra=123.456,
+        dec=-12.345,
+        filter="ztfg",
+        exposure_time=30.0,
+        program_pi="benchmark",
+        status="pending",
+        sequence=i,
+        instrument_id=1,
+        observation_plan_id=1,
+        created_at=now,
+        modified=now,
+    )
+    for i in range(args.observations)
+]
+
+serializers = {
+    "to_json": lambda data: to_json({"status": "success", "data": data}),
+    "dumps": lambda data: dumps({"status": "success", "data": data}),
+    "dumps (pretty)": lambda data: dumps(
+        {"status": "success", "data": data}, pretty=True
+    ),
+}
+
+for name, data in [("plans", plans), ("observations", observations)]:
+    print(f"{len(data)} {name}")
+    baseline = None
+    for serializer, serialize in serializers.items():
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            size = len(serialize(data))
+            durations.append(time.perf_counter() - start)
+        duration = min(durations)
+        baseline = baseline or duration
+        print(
+            f"  {serializer:<16}{duration * 1000:>8.1f} ms{size / 1e6:>8.2f} MB"
+            f"{baseline / duration:>8.1f}x"
+        )
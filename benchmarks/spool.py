@@ -0,0 +1,95 @@
+# benchmark of the spool mode: times the submission of plans of increasing
+# size when they are added to the database by the request, and when they
+# are only written to the spool, then how long the ingester takes to add
+# the spooled plans to the database
+#
+# run with: PYTHONPATH=. python benchmarks/spool.py --config=config.yaml
+#
+# it runs against the `<database>_test` database (see utils/db_init.py),
+# whose tables are dropped and recreated, with a spool in a temporary folder
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import sqlalchemy as sa
+import tornado.httpserver
+import tornado.netutil
+from tornado.httpclient import AsyncHTTPClient
+
+from common import load_test_env, make_plan, reset_database
+
+parser = argparse.ArgumentParser(description="Benchmark the spool mode.")
+parser.add_argument(
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[10, 1000, 10000],
+    help="number of targets of the plans",
+)
+parser.add_argument("--repeat", type=int, default=20, help="plans per size and mode")
+args, _ = parser.parse_known_args()
+
+env, cfg = load_test_env()
+directory = tempfile.mkdtemp()
+cfg["spool"] = {
+    **cfg.get("spool", {}),
+    "enabled": True,
+    "path": os.path.join(directory, "plans.jsonl"),
+}
+
+from skyportal_mma_facility.app_server import make_app
+from skyportal_mma_facility.handlers.api import obsplan
+from skyportal_mma_facility.ingest_server import Ingester
+from skyportal_mma_facility.models import DBSession, ObservationPlan
+
+
+def count_plans():
+    with DBSession() as session:
+        return session.scalar(sa.select(sa.func.count(ObservationPlan.id)))
+
+
+async def main():
+    app = make_app(cfg)
+    reset_database()
+
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    tornado.httpserver.HTTPServer(app).add_sockets(sockets)
+    url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/api/obsplans"
+    client = AsyncHTTPClient()
+    spool = obsplan.spool
+
+    print(f"{'targets':>8}{'insert (ms)':>14}{'spool (ms)':>14}{'ingested (s)':>14}")
+    for size in args.sizes:
+        plans = [json.dumps(make_plan(size)) for _ in range(2 * args.repeat)]
+        durations = {}
+        for mode, bodies in [
+            ("insert", plans[: args.repeat]),
+            ("spool", plans[args.repeat :]),
+        ]:
+            obsplan.spool = spool if mode == "spool" else None
+            durations[mode] = []
+            for body in bodies:
+                start = time.perf_counter()
+                await client.fetch(url, method="PUT", body=body, request_timeout=300)
+                durations[mode].append(time.perf_counter() - start)
+
+        # then ingest the spooled plans
+        start = time.perf_counter()
+        expected = count_plans() + args.repeat
+        ingester = Ingester(spool)
+        while ingester.ingest_batch() > 0:
+            pass
+        assert count_plans() == expected
+        ingested = time.perf_counter() - start
+        print(
+            f"{size:>8}{np.median(durations['insert']) * 1000:>14.1f}"
+            f"{np.median(durations['spool']) * 1000:>14.1f}{ingested:>14.2f}"
+        )
+
+
+asyncio.run(main())
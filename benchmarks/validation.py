@@ -0,0 +1,57 @@
+# benchmark of the validation of observation plans: times the validation of
+# plans of increasing size, valid or with a fraction of invalid targets
+#
+# run with: PYTHONPATH=. python benchmarks/validation.py --config=config.yaml
+
+import argparse
+import time
+
+import numpy as np
+
+from common import make_plan
+from skyportal_mma_facility.handlers.api.obsplan import validate_observation_plan
+
+parser = argparse.ArgumentParser(description="Benchmark the validation of plans.")
+parser.add_argument(
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[10, 1000, 10000, 100000],
+    help="number of targets of the plans",
+)
+parser.add_argument(
+    "--invalid", type=float, default=0.01, help="fraction of invalid targets"
+)
+parser.add_argument("--repeat", type=int, default=5, help="runs per plan")
+args, _ = parser.parse_known_args()
+
+filters = ["ztfg", "ztfr", "ztfi"]
+rng = np.random.default_rng(0)
+
+
+def make_invalid_plan(targets, invalid):
+    """Make a plan, with a fraction `invalid` of its targets out of range and
+    with an unknown filter."""
+    plan = make_plan(targets, filters, rng)
+    for target, bad in zip(plan["targets"], rng.random(targets) < invalid):
+        if bad:
+            target.update(ra=target["ra"] + 360, exposure_time=-1, filter="sdssu")
+    return plan
+
+
+print(f"{'targets':>8}{'valid (ms)':>14}{'invalid (ms)':>14}{'errors':>8}")
+for size in args.sizes:
+    durations = {}
+    for name, plan in [
+        ("valid", make_plan(size, filters, rng)),
+        ("invalid", make_invalid_plan(size, args.invalid)),
+    ]:
+        durations[name] = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            errors = validate_observation_plan(plan, filters=filters)
+            durations[name].append(time.perf_counter() - start)
+    print(
+        f"{size:>8}{min(durations['valid']) * 1000:>14.2f}"
+        f"{min(durations['invalid']) * 1000:>14.2f}{len(errors):>8}"
+    )
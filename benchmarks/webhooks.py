@@ -0,0 +1,190 @@
+# benchmark of the delivery of webhooks: completes the observations of a plan
+# whose `callback_url` points to a local stand-in for SkyPortal, then measures
+# how long the queue spends writing the notifications, and how long they
+# take to be delivered, with the stand-in answering slowly and failing
+# some of the requests
+#
+# run with: PYTHONPATH=. python benchmarks/webhooks.py --config=config.yaml
+#
+# it runs against the `<database>_test` database (see utils/db_init.py),
+# whose tables are dropped and recreated
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import sqlalchemy as sa
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+from common import load_test_env, reset_database
+
+parser = argparse.ArgumentParser(description="Benchmark the delivery of webhooks.")
+parser.add_argument(
+    "--observations", type=int, default=2000, help="observations completed"
+)
+parser.add_argument(
+    "--latency", type=float, default=0.5, help="seconds the stand-in takes to answer"
+)
+parser.add_argument(
+    "--failure-rate",
+    type=float,
+    default=0.2,
+    help="fraction of the requests the stand-in fails",
+)
+args, _ = parser.parse_known_args()
+
+env, cfg = load_test_env()
+# retry the failed deliveries right away
+cfg["webhooks"] = {**cfg.get("webhooks", {}), "backoff": 0.1, "max_backoff": 1}
+
+from skyportal_mma_facility.app_server import make_app
+from skyportal_mma_facility.models import (
+    DBSession,
+    Observation,
+    ObservationPlan,
+    Webhook,
+)
+from skyportal_mma_facility.webhook_server import WebhookDeliverer, enqueue_webhook
+
+
+class StandInHandler(tornado.web.RequestHandler):
+    """A stand-in for SkyPortal, answering slowly, and failing some of the
+    requests."""
+
+    received = {}
+    requests = 0
+
+    async def post(self):
+        StandInHandler.requests += 1
+        await asyncio.sleep(args.latency)
+        if random.random() < args.failure_rate:
+            raise tornado.web.HTTPError(503)
+        for observation in json.loads(self.request.body)["observations"]:
+            StandInHandler.received[observation["id"]] = time.perf_counter()
+
+
+def setup(url):
+    instrument_id = reset_database()
+    with DBSession() as session:
+        now = datetime.utcnow()
+        plan = ObservationPlan(
+            queue_name=str(uuid.uuid4()),
+            user="benchmark",
+            status="processing",
+            instrument_id=instrument_id,
+            validity_window_start=now,
+            validity_window_end=now + timedelta(days=1),
+            payload={"callback_url": url},
+        )
+        session.add(plan)
+        session.flush()
+        session.execute(
+            sa.insert(Observation),
+            [
+                {
+                    "request_id": i,
+                    "field_id": i,
+                    "ra": 10.0,
+                    "dec": 10.0,
+                    "filter": "ztfg",
+                    "exposure_time": 30.0,
+                    "program_pi": "benchmark",
+                    "status": "processing",
+                    "instrument_id": instrument_id,
+                    "observation_plan_id": plan.id,
+                }
+                for i in range(args.observations)
+            ],
+        )
+        session.commit()
+        return session.scalars(sa.select(Observation.id)).all()
+
+
+def complete(observation_id, webhook):
+    """Complete an observation as the queue does, and return how long the
+    transaction took."""
+    start = time.perf_counter()
+    with DBSession.session_factory() as session:
+        session.execute(
+            sa.update(Observation)
+            .where(Observation.id == observation_id)
+            .values(status="done")
+        )
+        if webhook:
+            enqueue_webhook(session, observation_id)
+        session.commit()
+    return time.perf_counter() - start
+
+
+async def main():
+    make_app(cfg)
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}/skyportal"
+    server = tornado.httpserver.HTTPServer(
+        tornado.web.Application([(r"/skyportal", StandInHandler)])
+    )
+    server.add_sockets(sockets)
+
+    observation_ids = setup(url)
+    half = len(observation_ids) // 2
+    durations = {
+        "without webhook": [complete(id, False) for id in observation_ids[:half]],
+    }
+
+    deliverer = WebhookDeliverer()
+    deliverer.start(DBSession.session_factory.kw["bind"])
+    await asyncio.sleep(0.5)
+
+    start = time.perf_counter()
+    # the stand-in is slow, but completing an observation only writes to the
+    # outbox, so it does not wait for it
+    durations["with webhook"] = []
+    for id in observation_ids[half:]:
+        durations["with webhook"].append(complete(id, True))
+        # let the deliverer run in between, as the queue's event loop would
+        await asyncio.sleep(0)
+    queued = time.perf_counter() - start
+
+    print(
+        f"completing an observation (stand-in answering in {args.latency}s, "
+        f"failing {args.failure_rate:.0%} of the requests):"
+    )
+    for name, values in durations.items():
+        print(
+            f"  {name:<16} p50 {np.percentile(values, 50) * 1000:.2f} ms, "
+            f"max {np.max(values) * 1000:.2f} ms"
+        )
+
+    expected = len(observation_ids) - half
+    while True:
+        with DBSession() as session:
+            pending = session.scalar(
+                sa.select(sa.func.count()).where(Webhook.status == "pending")
+            )
+        if pending == 0:
+            break
+        await asyncio.sleep(0.05)
+    delivered = time.perf_counter() - start
+    with DBSession() as session:
+        statuses = dict(
+            session.execute(
+                sa.select(Webhook.status, sa.func.count()).group_by(Webhook.status)
+            ).all()
+        )
+        retries = session.scalar(sa.select(sa.func.sum(Webhook.attempts - 1)))
+    print(
+        f"{expected} notifications written in {queued:.2f}s, "
+        f"{len(StandInHandler.received)} received after {delivered:.2f}s in "
+        f"{StandInHandler.requests} requests ({retries} retried), "
+        f"statuses: {statuses}"
+    )
+
+
+asyncio.run(main())
@@ -1,5 +1,8 @@
 # this is a microservice that is used to run the app
 
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
 import tornado.web
 from tornado.ioloop import IOLoop
 from skyportal_mma_facility.utils import load_env, make_log
@@ -9,13 +12,33 @@ log = make_log("app")
 
 env, cfg = load_env()
 
-app = make_app(cfg)
-
 port = cfg["server.port"]
 
 address = "127.0.0.1"
 
-app.listen(port, xheaders=True, address=address)
+# number of processes serving the app, 0 for one per CPU core
+processes = cfg.get("server.processes", 1)
+if processes == 0:
+    processes = tornado.process.cpu_count()
+if processes > 1 and env.debug:
+    # the autoreload of the debug mode restarts a single process
+    log("Debug mode: ignoring server.processes, running a single process")
+    processes = 1
+
+sockets = tornado.netutil.bind_sockets(port, address=address)
+
+if processes > 1:
+    # fork before connecting to the database, so that each process opens
+    # its own connections; the processes share the listening socket, and
+    # the parent restarts those that die
+    log(f"Forking {processes} processes")
+    tornado.process.fork_processes(processes)
+    log = make_log(f"app:{tornado.process.task_id()}")
+
+app = make_app(cfg, processes=processes)
+
+server = tornado.httpserver.HTTPServer(app, xheaders=True)
+server.add_sockets(sockets)
 
 log(f"Listening on {address}:{port}")
-tornado.ioloop.IOLoop.current().start()
+IOLoop.current().start()
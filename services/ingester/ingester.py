@@ -0,0 +1,41 @@
+# this is a microservice that adds the observation plans submitted in spool
+# mode (see `spool` in config.yaml) to the database
+
+import sys
+import time
+
+from skyportal_mma_facility.ingest_server import Ingester
+from skyportal_mma_facility.models import DBSession, ObservationPlan, init_db
+from skyportal_mma_facility.utils.env import load_env
+from skyportal_mma_facility.utils.log import make_log
+from skyportal_mma_facility.utils.spool import Spool
+
+log = make_log("ingester")
+
+env, cfg = load_env()
+
+# without spool mode, the API adds the plans to the database itself
+if not cfg.get("spool.enabled", False):
+    log("Spool mode is disabled (spool.enabled), nothing to ingest")
+    sys.exit(0)
+
+init_db(
+    **cfg["database"],
+    autoflush=False,
+    engine_args={"pool_size": 2, "max_overflow": 2, "pool_recycle": 3600},
+)
+
+log("Waiting for the database to be ready")
+while True:
+    try:
+        with DBSession() as session:
+            session.query(ObservationPlan.id).first()
+        break
+    except Exception as e:
+        log(f"The database is not ready ({e}), retrying in 5 seconds")
+        time.sleep(5)
+
+spool = Spool(cfg.get("spool.path", "spool/plans.jsonl"))
+log(f"Ingesting {spool.path}")
+
+Ingester(spool).run()
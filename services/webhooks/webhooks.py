@@ -0,0 +1,38 @@
+# this is a microservice that sends the notifications of the webhooks
+# outbox, e.g. the completed observations, to the requesters of the plans
+
+import asyncio
+import time
+
+from skyportal_mma_facility.models import DBSession, Webhook, init_db
+from skyportal_mma_facility.utils.env import load_env
+from skyportal_mma_facility.utils.log import make_log
+from skyportal_mma_facility.webhook_server import WebhookDeliverer
+
+log = make_log("webhooks")
+
+env, cfg = load_env()
+
+engine = init_db(
+    **cfg["database"],
+    autoflush=False,
+    engine_args={"pool_size": 2, "max_overflow": 2, "pool_recycle": 3600},
+)
+
+log("Waiting for the database to be ready")
+while True:
+    try:
+        with DBSession() as session:
+            session.query(Webhook.id).first()
+        break
+    except Exception as e:
+        log(f"The database is not ready ({e}), retrying in 5 seconds")
+        time.sleep(5)
+
+log("Starting the webhooks service")
+
+deliverer = WebhookDeliverer()
+
+loop = asyncio.get_event_loop()
+loop.call_soon(deliverer.start, engine)
+loop.run_forever()
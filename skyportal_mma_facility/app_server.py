@@ -1,9 +1,10 @@
 import tornado.web
 from tornado.ioloop import IOLoop
 
-from skyportal_mma_facility.models import init_db
+from skyportal_mma_facility.models import DBSession, init_db
 from skyportal_mma_facility.utils import load_env, make_log
 from skyportal_mma_facility.utils.model_util import create_tables, drop_tables
+from skyportal_mma_facility.utils.notifications import Broker, OBSERVATION_CHANNEL
 
 env, cfg = load_env()
 
@@ -13,14 +14,28 @@ from skyportal_mma_facility.handlers.api import (
     TelescopeHandler,
     InstrumentHandler,
     ObservationPlanHandler,
+    ObservationPlanObservationsHandler,
+    ObservationPlanSummaryHandler,
+    ObservationPlanEventsHandler,
+    SpooledObservationPlanHandler,
     DemoHandler,
+    HealthHandler,
+    ReadyHandler,
 )
+from skyportal_mma_facility.handlers.api.base import set_db_threads
+from skyportal_mma_facility.handlers.api.health import DatabaseHealth
 
 handlers = [
     (r"/api/telescopes(/[0-9]+)?", TelescopeHandler),
     (r"/api/instruments(/[0-9]+)?", InstrumentHandler),
     (r"/api/obsplans(/[0-9]+)?", ObservationPlanHandler),
+    (r"/api/obsplans/([0-9]+)/observations", ObservationPlanObservationsHandler),
+    (r"/api/obsplans/([0-9]+)/summary", ObservationPlanSummaryHandler),
+    (r"/api/obsplans/([0-9]+)/events", ObservationPlanEventsHandler),
+    (r"/api/obsplans/spooled/([0-9a-f]+)", SpooledObservationPlanHandler),
     (r"/api/demo", DemoHandler),
+    (r"/api/health", HealthHandler),
+    (r"/api/ready", ReadyHandler),
 ]
 
 settings = {
@@ -29,14 +44,27 @@ settings = {
 }
 
 
-def make_app(cfg):
+def make_app(cfg, processes=1):
+    """Make the app, and connect it to the database.
+
+    When the app is served by several processes, each of them makes its
+    own app after forking, and the connections of `server.pool_size` and
+    `server.max_overflow`, as well as the `app.db_threads` threads running
+    the handlers, are split between them.
+    """
     app = tornado.web.Application(handlers, **settings)
 
     init_db(
         **cfg["database"],
         autoflush=False,
-        engine_args={"pool_size": 10, "max_overflow": 15, "pool_recycle": 3600},
+        engine_args={
+            "pool_size": max(1, cfg.get("server.pool_size", 10) // processes),
+            "max_overflow": cfg.get("server.max_overflow", 15) // processes,
+            "pool_recycle": 3600,
+        },
     )
+    # so that the threads do not wait for connections
+    set_db_threads(max(1, cfg.get("app.db_threads", 10) // processes))
     if env.debug:
         log("DEBUG MODE: dropping and recreating all tables")
         drop_tables()
@@ -46,6 +74,22 @@ def make_app(cfg):
 
     app.cfg = cfg
 
+    # check the database in the background, for the health endpoints
+    app.health = DatabaseHealth(
+        interval=cfg.get("app.health_interval", 5),
+        timeout=cfg.get("app.health_timeout", 2),
+    )
+    IOLoop.current().add_callback(app.health.run)
+
+    # a single connection listens to the status changes committed by the
+    # queue, and fans them out to the event streams of this process
+    app.events = Broker(
+        DBSession.session_factory.kw["bind"],
+        OBSERVATION_CHANNEL,
+        key="observation_plan_id",
+    )
+    IOLoop.current().add_callback(app.events.start)
+
     return app
 
 
@@ -0,0 +1,28 @@
+import importlib
+
+from .base import FacilityDriver, FacilityError
+from .simulator import SimulatorDriver
+
+drivers = {
+    "simulator": SimulatorDriver,
+}
+
+
+def load_driver(cfg, data_directory):
+    """Instantiate the facility driver chosen by `facility.driver` in the
+    configuration: either the name of a built-in driver, or the import path
+    of a `FacilityDriver` subclass, e.g. `mypackage.drivers.MyTelescope`.
+    The driver is configured by the `facility.<name>` section."""
+    name = cfg.get("facility.driver", "simulator")
+    if name in drivers:
+        driver_class = drivers[name]
+        options = cfg.get(f"facility.{name}", {}) or {}
+    else:
+        module_name, _, class_name = name.rpartition(".")
+        driver_class = getattr(importlib.import_module(module_name), class_name)
+        options = cfg.get(f"facility.{class_name}", {}) or {}
+
+    if not issubclass(driver_class, FacilityDriver):
+        raise ValueError(f"{name} is not a FacilityDriver")
+
+    return driver_class(data_directory, **options)
@@ -0,0 +1,46 @@
+__all__ = ["FacilityDriver", "FacilityError"]
+
+import os
+
+
+class FacilityError(Exception):
+    """Raised by a driver when an observation could not be performed."""
+
+
+class FacilityDriver:
+    """Interface between the observation queue and a facility.
+
+    A driver triggers an observation on the facility, waits for it to be
+    completed without blocking the event loop, and returns the path to the
+    resulting FITS file. Drivers are chosen with `facility.driver` in the
+    configuration, and receive the options of their `facility.<name>`
+    section as keyword arguments.
+    """
+
+    def __init__(self, data_directory, **kwargs):
+        self.data_directory = data_directory
+
+    def path(self, observation):
+        """Path of the FITS file of an observation."""
+        return os.path.join(self.data_directory, f"{observation.id}.fits")
+
+    async def observe(self, observation):
+        """Perform an observation.
+
+        Parameters
+        ----------
+        observation : skyportal_mma_facility.models.Observation
+            The observation to perform. It is detached from any session,
+            so only its columns can be used.
+
+        Returns
+        -------
+        str
+            The path to the FITS file of the observation.
+
+        Raises
+        ------
+        FacilityError
+            If the observation could not be performed.
+        """
+        raise NotImplementedError
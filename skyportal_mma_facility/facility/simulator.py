@@ -0,0 +1,88 @@
+__all__ = ["SimulatorDriver"]
+
+import asyncio
+import random
+from datetime import datetime
+
+import numpy as np
+from astropy.io import fits
+
+from skyportal_mma_facility.facility.base import FacilityDriver, FacilityError
+
+
+class SimulatorDriver(FacilityDriver):
+    """Simulated facility, to run the queue without a telescope.
+
+    Each observation takes its exposure time plus a fixed overhead (slew,
+    readout, ...) with some gaussian jitter, all multiplied by `time_scale`,
+    then fails with probability `failure_rate` or writes a FITS image of
+    gaussian noise.
+
+    Parameters
+    ----------
+    data_directory : str
+        Directory where the FITS files are written.
+    time_scale : float, optional
+        Factor applied to the duration of the observations: 1 for real
+        time, 0.01 to run 100 times faster, 0 not to wait at all.
+    overhead : float, optional
+        Overhead of each observation, in seconds.
+    jitter : float, optional
+        Standard deviation of the overhead, in seconds.
+    failure_rate : float, optional
+        Probability for an observation to fail.
+    image_size : int, optional
+        Size of the side of the simulated images, in pixels.
+    """
+
+    def __init__(
+        self,
+        data_directory,
+        time_scale=1.0,
+        overhead=10.0,
+        jitter=0.0,
+        failure_rate=0.0,
+        image_size=64,
+        **kwargs,
+    ):
+        super().__init__(data_directory, **kwargs)
+        self.time_scale = time_scale
+        self.overhead = overhead
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.image_size = image_size
+
+    def duration(self, observation):
+        overhead = max(0.0, random.gauss(self.overhead, self.jitter))
+        return (observation.exposure_time + overhead) * self.time_scale
+
+    def write(self, observation, path):
+        data = np.random.normal(100.0, 10.0, (self.image_size, self.image_size)).astype(
+            np.float32
+        )
+        hdu = fits.PrimaryHDU(data)
+        hdu.header["OBSID"] = (observation.id, "Observation ID")
+        hdu.header["REQID"] = (observation.request_id, "SkyPortal request ID")
+        hdu.header["FIELDID"] = (observation.field_id, "Field ID")
+        hdu.header["RA"] = (observation.ra, "[deg] Right ascension")
+        hdu.header["DEC"] = (observation.dec, "[deg] Declination")
+        hdu.header["FILTER"] = (observation.filter, "Filter")
+        hdu.header["EXPTIME"] = (observation.exposure_time, "[s] Exposure time")
+        hdu.header["DATE-OBS"] = (datetime.utcnow().isoformat(), "UTC date")
+        hdu.header["PROGPI"] = (observation.program_pi, "Program PI")
+        hdu.header["SIMULATE"] = (True, "Simulated observation")
+        hdu.writeto(path, overwrite=True)
+
+    async def observe(self, observation):
+        duration = self.duration(observation)
+        if duration > 0:
+            await asyncio.sleep(duration)
+        if random.random() < self.failure_rate:
+            raise FacilityError(f"Simulated failure of observation {observation.id}")
+
+        path = self.path(observation)
+        # writing the file is blocking, keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.write, observation, path
+        )
+        return path
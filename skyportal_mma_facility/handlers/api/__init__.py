@@ -1,4 +1,11 @@
 from .base import BaseHandler
 from .facility import TelescopeHandler, InstrumentHandler
-from .obsplan import ObservationPlanHandler
+from .obsplan import (
+    ObservationPlanHandler,
+    ObservationPlanObservationsHandler,
+    ObservationPlanSummaryHandler,
+    SpooledObservationPlanHandler,
+)
 from .demo import DemoHandler
+from .health import HealthHandler, ReadyHandler
+from .events import ObservationPlanEventsHandler
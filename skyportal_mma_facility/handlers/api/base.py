@@ -1,17 +1,77 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+import sqlalchemy as sa
 import tornado
 from tornado.web import RequestHandler
 from skyportal_mma_facility.models import VerifiedSession, DBSession, session_context_id
 
 import uuid
-import time
+import traceback
 from json.decoder import JSONDecodeError
 from skyportal_mma_facility.utils.env import load_env
 from skyportal_mma_facility.utils.log import make_log
-from skyportal_mma_facility.utils.json_util import to_json
+from skyportal_mma_facility.utils.json_util import dumps
 
 env, cfg = load_env()
 
+log = make_log("api")
+
+# the handlers run in a pool of threads, so that a slow query or insert
+# does not hold up the other requests on the event loop; it is resized by
+# `make_app` once the number of processes serving the app is known
+executor = ThreadPoolExecutor(
+    max_workers=cfg.get("app.db_threads", 10), thread_name_prefix="api-db"
+)
+
+# seconds a client has to receive each chunk of a stream: a stream holds a
+# thread and a database connection, so a client reading slower is cut off
+stream_timeout = cfg.get("app.stream_timeout", 10)
+
+# number of rows per page of the paginated listings, by default and at most
+default_page_size = cfg.get("app.page_size", 100)
+max_page_size = cfg.get("app.max_page_size", 1000)
+
+
+def set_db_threads(threads):
+    """Replace the handlers' thread pool with one of `threads` threads.
+
+    Must be called before the app serves any request, e.g. to match the
+    size of the connection pool of the process.
+    """
+    global executor
+    executor.shutdown(wait=False)
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="api-db")
+
+
+async def run_in_thread(func, *args):
+    """Run `func(*args)` in the handlers' thread pool, in a copy of the
+    current context, and return its result."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(context.run, func, *args)
+    )
+
+
+def run_in_executor(method):
+    """Run a synchronous handler method in the handlers' thread pool.
+
+    This is a decorator for Tornado handler `get`, `put`, etc. methods.
+    The method runs in a copy of the request's context, so that it uses
+    the request's scoped session, and writes its response as usual: the
+    response is sent once it returns.
+    """
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        self.loop = asyncio.get_running_loop()
+        return await run_in_thread(functools.partial(method, self, *args, **kwargs))
+
+    return wrapper
+
 
 class NoValue:
     pass
@@ -70,17 +130,11 @@ class BaseHandler(RequestHandler):
         if len(self.path_args) == 1 and self.path_args[0] is None:
             self.path_args = []
 
-        # TODO Refactor to be a context manager or utility function
-        N = 5
-        for i in range(1, N + 1):
-            try:
-                assert DBSession.session_factory.kw["bind"] is not None
-            except Exception as e:
-                if i == N:
-                    raise e
-                else:
-                    print("Error connecting to database, sleeping for a while")
-                    time.sleep(5)
+        # the app connects to the database when it starts, and its health
+        # is then checked in the background: never wait for it here
+        if DBSession.session_factory.kw.get("bind") is None:
+            self.error("The database is not available", status=503)
+            return self.finish()
 
         return super().prepare()
 
@@ -132,7 +186,8 @@ class BaseHandler(RequestHandler):
     def success(self, data={}, action=None, payload={}, status=200, extra={}):
         """Write data and send actions on API success.
 
-        The return JSON has the following format::
+        The JSON is compact, unless the request has `?pretty=true`, and has
+        the following format::
 
           {
             "status": "success",
@@ -162,7 +217,167 @@ class BaseHandler(RequestHandler):
 
         self.set_header("Content-Type", "application/json")
         self.set_status(status)
-        self.write(to_json({"status": "success", "data": data, **extra}))
+        self.write(
+            dumps(
+                {"status": "success", "data": data, **extra},
+                pretty=self.get_query_argument("pretty", False),
+            )
+        )
+
+    def get_fields(self, model):
+        """Parse the comma-separated `fields` query argument, used to only
+        select and return some of the columns of `model`.
+
+        Parameters
+        ----------
+        model : skyportal_mma_facility.models.Base
+            The model whose columns can be requested.
+
+        Returns
+        -------
+        list of str or None
+            The names of the requested columns, or None to return them all.
+
+        Raises
+        ------
+        ValueError
+            If one of the fields is not a column of the model.
+        """
+        fields = self.get_query_argument("fields", None)
+        if fields is None:
+            return None
+        columns = [
+            name
+            for name in sa.inspect(model).columns.keys()
+            if not name.startswith("_")
+        ]
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in columns]
+        if len(fields) == 0 or len(unknown) > 0:
+            raise ValueError(
+                f"Invalid field(s) {', '.join(unknown)}, must be among {', '.join(columns)}"
+            )
+        return list(dict.fromkeys(fields))
+
+    @staticmethod
+    def query_fields(session, model, fields, keys=()):
+        """Query the columns `fields` of `model`, or the whole objects.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.Session
+            The session to query.
+        model : skyportal_mma_facility.models.Base
+            The model to query.
+        fields : list of str or None
+            The names of the columns to select, as returned by `get_fields`,
+            or None to query the objects.
+        keys : list of sqlalchemy.Column, optional
+            Columns to select as well, e.g. to make the cursor of the next
+            page, if they are not among `fields`.
+
+        Returns
+        -------
+        sqlalchemy.orm.Query
+            The query.
+        """
+        if fields is None:
+            return session.query(model)
+        return session.query(
+            *[getattr(model, field) for field in fields],
+            *[key for key in keys if key.key not in fields],
+        )
+
+    @staticmethod
+    def serialize_fields(fields):
+        """Return a function turning the rows of `query_fields` into dicts of
+        the columns `fields`, or returning the objects as they are if
+        `fields` is None."""
+        if fields is None:
+            return lambda row: row
+        return lambda row: {field: getattr(row, field) for field in fields}
+
+    def get_limit(self):
+        """Parse the `limit` query argument, the number of rows of a page.
+
+        Returns
+        -------
+        int
+            The limit, `app.page_size` by default.
+
+        Raises
+        ------
+        ValueError
+            If the limit is not an integer between 1 and `app.max_page_size`.
+        """
+        try:
+            limit = int(self.get_query_argument("limit", default_page_size))
+        except ValueError:
+            raise ValueError("Limit must be an integer")
+        if not 1 <= limit <= max_page_size:
+            raise ValueError(f"Limit must be between 1 and {max_page_size}")
+        return limit
+
+    def wants_stream(self):
+        """Whether the request asks for newline-delimited JSON, with
+        `Accept: application/x-ndjson` or `?stream=true`."""
+        stream = self.get_query_argument("stream", False)
+        accept = self.request.headers.get("Accept", "")
+        return stream or "application/x-ndjson" in accept
+
+    def stream(self, query, serialize=None, chunk_size=1000):
+        """Stream the results of a query as newline-delimited JSON.
+
+        The rows are fetched `chunk_size` at a time from a server-side
+        cursor, and each chunk is sent before fetching the next one, so
+        that memory stays flat however many rows there are. A client that
+        does not receive a chunk within `app.stream_timeout` seconds is
+        disconnected, so that it does not hold the thread and the database
+        connection of the stream. Must be called from a method decorated
+        with `run_in_executor`.
+
+        Parameters
+        ----------
+        query : sqlalchemy.orm.Query
+            The query whose rows to stream, one JSON object per line.
+        serialize : callable, optional
+            Function turning a row into what is serialized, e.g. a dict.
+        chunk_size : int, optional
+            Number of rows fetched and sent at a time.
+        """
+        self.set_header("Content-Type", "application/x-ndjson")
+        self.set_status(200)
+        lines = []
+        flushed = False
+        try:
+            for row in query.yield_per(chunk_size):
+                lines.append(dumps(serialize(row) if serialize else row))
+                if len(lines) == chunk_size:
+                    self.write(b"\n".join(lines) + b"\n")
+                    lines = []
+                    flushed = True
+                    # wait for the client to receive the chunk
+                    future = asyncio.run_coroutine_threadsafe(self._flush(), self.loop)
+                    try:
+                        future.result(timeout=stream_timeout)
+                    except concurrent.futures.TimeoutError:
+                        future.cancel()
+                        raise TimeoutError(
+                            f"The client did not receive a chunk in {stream_timeout}s"
+                        )
+        except Exception:
+            if not flushed:
+                raise
+            # the response has started already: it can only be cut short, by
+            # closing the connection so that the client sees it was
+            self.loop.call_soon_threadsafe(self.request.connection.close)
+            log(f"Error streaming {self.request.uri}: {traceback.format_exc()}")
+            return
+        if len(lines) > 0:
+            self.write(b"\n".join(lines) + b"\n")
+
+    async def _flush(self):
+        await self.flush()
 
     def get_query_argument(self, value, default=NoValue, **kwargs):
         if default != NoValue:
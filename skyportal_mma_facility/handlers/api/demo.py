@@ -1,17 +1,16 @@
 # import Session from sqlalchemy stuff
 
 from sqlalchemy.orm.session import Session
-from astropy.time import Time
 import uuid
 
 from skyportal_mma_facility.handlers.api import BaseHandler
+from skyportal_mma_facility.handlers.api.base import run_in_executor
+from skyportal_mma_facility.handlers.api.obsplan import insert_observation_plan
 from skyportal_mma_facility.utils.access import auth_or_token
 
 from skyportal_mma_facility.models import (
     Telescope,
     Instrument,
-    ObservationPlan,
-    Observation,
 )
 
 
@@ -21,7 +20,7 @@ def post_demo(session: Session) -> int:
         name=name, nickname=name, diameter=1.0, robotic=True, fixed_location=True
     )
     session.add(telescope)
-    session.commit()
+    session.flush()
 
     instrument = Instrument(
         name=name,
@@ -31,7 +30,7 @@ def post_demo(session: Session) -> int:
         telescope_id=telescope.id,
     )
     session.add(instrument)
-    session.commit()
+    session.flush()
 
     data = {
         "targets": [
@@ -97,44 +96,21 @@ def post_demo(session: Session) -> int:
         "status": "pending",
     }
 
-    observation_plan = ObservationPlan(
-        queue_name=data["queue_name"],
-        user=data["user"],
-        status=data["status"],
-        instrument_id=instrument.id,
-        validity_window_start=Time(
-            data["validity_window_mjd"][0], format="mjd"
-        ).datetime,
-        validity_window_end=Time(data["validity_window_mjd"][1], format="mjd").datetime,
-        payload=data,
-    )
-    session.add(observation_plan)
+    # everything is committed at once
+    observation_plan_id = insert_observation_plan(session, data, instrument.id)
     session.commit()
 
-    for observation in data["targets"]:
-        obs = Observation(
-            request_id=observation["request_id"],
-            field_id=observation["field_id"],
-            ra=observation["ra"],
-            dec=observation["dec"],
-            filter=observation["filter"],
-            exposure_time=observation["exposure_time"],
-            program_pi=observation["program_pi"],
-            observation_plan_id=observation_plan.id,
-            instrument_id=instrument.id,
-        )
-        session.add(obs)
-        session.commit()
-
-    return observation_plan.id
+    return observation_plan_id
 
 
 class DemoHandler(BaseHandler):
+    @run_in_executor
     def get(self):
         with self.Session() as session:
             observation_plan_id = post_demo(session)
             return self.success(data={"id": observation_plan_id})
 
+    @run_in_executor
     def post(self):
         with self.Session() as session:
             observation_plan_id = post_demo(session)
@@ -0,0 +1,80 @@
+import asyncio
+
+from tornado.iostream import StreamClosedError
+
+from skyportal_mma_facility.handlers.api import BaseHandler
+from skyportal_mma_facility.handlers.api.base import run_in_thread
+from skyportal_mma_facility.handlers.api.obsplan import summarize_observation_plan
+from skyportal_mma_facility.utils.env import load_env
+from skyportal_mma_facility.utils.json_util import dumps
+
+env, cfg = load_env()
+
+# a comment is sent when there has been no event for that long, so that
+# proxies keep the connection open and closed connections are noticed
+keepalive_interval = cfg.get("app.events_keepalive", 15)
+
+
+class ObservationPlanEventsHandler(BaseHandler):
+    """Stream the status changes of a plan and of its observations, as
+    Server-Sent Events, e.g. with an `EventSource` in a browser.
+
+    The stream starts with a `summary` event, the same as
+    `/api/obsplans/{id}/summary`, followed by one `status` event per
+    change committed by the queue, such as::
+
+      event: status
+      data: {"observation_plan_id": 1, "observation_ids": [1], "status": "done"}
+
+    It ends once the plan is done, or missed. If the client cannot keep up
+    with the events, the stream is closed, and a client reconnecting gets
+    a new summary to start from.
+    """
+
+    async def get(self, observation_plan_id):
+        observation_plan_id = int(observation_plan_id)
+        events = self.application.events
+        # subscribe before getting the summary, so that no change committed
+        # in between is missed
+        subscription = events.subscribe(observation_plan_id)
+        try:
+            summary = await run_in_thread(self.summarize, observation_plan_id)
+            if summary is None:
+                return self.error(
+                    f"Could not find observation plan with ID {observation_plan_id}"
+                )
+
+            self.set_header("Content-Type", "text/event-stream")
+            self.set_header("Cache-Control", "no-cache")
+            # do not let nginx buffer the events
+            self.set_header("X-Accel-Buffering", "no")
+            await self.send("summary", summary)
+
+            status = summary["status"]
+            while status in ["pending", "processing"]:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(), keepalive_interval
+                    )
+                except asyncio.TimeoutError:
+                    self.write(": keepalive\n\n")
+                    await self.flush()
+                    continue
+                if subscription.overflow:
+                    break
+                await self.send("status", event)
+                if "observation_ids" not in event:
+                    status = event["status"]
+        except StreamClosedError:
+            # the client went away
+            pass
+        finally:
+            events.unsubscribe(subscription)
+
+    def summarize(self, observation_plan_id):
+        with self.Session() as session:
+            return summarize_observation_plan(session, observation_plan_id)
+
+    async def send(self, event, data):
+        self.write(b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n")
+        await self.flush()
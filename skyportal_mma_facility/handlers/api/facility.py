@@ -1,35 +1,45 @@
 from psycopg2.errors import UniqueViolation
+from sqlalchemy.orm import selectinload
 
 from skyportal_mma_facility.handlers.api import BaseHandler
+from skyportal_mma_facility.handlers.api.base import run_in_executor
 from skyportal_mma_facility.utils.access import auth_or_token
 
 from skyportal_mma_facility.models import Telescope, Instrument
 
 
 class TelescopeHandler(BaseHandler):
+    @run_in_executor
     def get(self, telescope_id=None):
         try:
             with self.Session() as session:
+                try:
+                    fields = self.get_fields(Telescope)
+                except ValueError as e:
+                    return self.error(str(e))
+                serialize = self.serialize_fields(fields)
+                query = self.query_fields(session, Telescope, fields)
+                if fields is None:
+                    # return the telescopes with their instruments, loaded
+                    # for all the telescopes at once
+                    query = query.options(selectinload(Telescope.instruments))
                 if telescope_id is not None:
-                    telescope = session.query(Telescope).get(telescope_id)
+                    telescope = query.filter(Telescope.id == telescope_id).first()
                     if telescope is None:
                         return self.error(
                             f"Could not find telescope with ID {telescope_id}"
                         )
-                    # return the telescope with the instruments
-                    telescope.instruments
-                    return self.success(data=telescope)
+                    return self.success(data=serialize(telescope))
 
                 else:
-                    telescopes = session.query(Telescope).all()
-                    for telescope in telescopes:
-                        telescope.instruments
-                    return self.success(data=telescopes)
+                    telescopes = query.all()
+                    return self.success(data=[serialize(row) for row in telescopes])
         except Exception as e:
             print(e)
             return self.error("Error retrieving telescope(s)")
 
     @auth_or_token
+    @run_in_executor
     def post(self):
         data = self.get_json()
 
@@ -49,25 +59,33 @@ class TelescopeHandler(BaseHandler):
 
 
 class InstrumentHandler(BaseHandler):
+    @run_in_executor
     def get(self, instrument_id=None):
         try:
             with self.Session() as session:
+                try:
+                    fields = self.get_fields(Instrument)
+                except ValueError as e:
+                    return self.error(str(e))
+                serialize = self.serialize_fields(fields)
+                query = self.query_fields(session, Instrument, fields)
                 if instrument_id is not None:
-                    instrument = session.query(Instrument).get(instrument_id)
+                    instrument = query.filter(Instrument.id == instrument_id).first()
                     if instrument is None:
                         return self.error(
                             f"Could not find instrument with ID {instrument_id}"
                         )
-                    return self.success(data=instrument.to_dict())
+                    return self.success(data=serialize(instrument))
 
                 else:
-                    instruments = session.query(Instrument).all()
+                    instruments = query.all()
 
-                    return self.success(data=instruments)
+                    return self.success(data=[serialize(row) for row in instruments])
         except Exception as e:
             return self.error("Error retrieving instrument(s)")
 
     @auth_or_token
+    @run_in_executor
     def post(self):
         data = self.get_json()
         try:
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from skyportal_mma_facility.handlers.api import BaseHandler
+from skyportal_mma_facility.models import DBSession
+from skyportal_mma_facility.utils import make_log
+
+log = make_log("health")
+
+
+class DatabaseHealth:
+    """Ping the database in the background, and keep the last result, so
+    that health checks are answered at once, without touching the database.
+
+    The ping runs in its own thread, so that it never waits behind the
+    requests, and is considered failed if it takes more than `timeout`
+    seconds.
+    """
+
+    def __init__(self, interval=5, timeout=2):
+        self.interval = interval
+        self.timeout = timeout
+        self.ok = False
+        self.latency = None
+        self.error = "The database has not been checked yet"
+        self.checked_at = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="api-health"
+        )
+
+    def _ping(self):
+        engine = DBSession.session_factory.kw.get("bind")
+        if engine is None:
+            raise RuntimeError("The database is not connected")
+        start = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(sa.text("SELECT 1"))
+        return time.perf_counter() - start
+
+    async def ping(self):
+        loop = asyncio.get_running_loop()
+        try:
+            self.latency = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, self._ping), self.timeout
+            )
+            if not self.ok:
+                log("The database is available")
+            self.ok, self.error = True, None
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = f"The database did not answer within {self.timeout}s"
+            if self.ok:
+                log(f"The database is not available: {e}")
+            self.ok, self.error, self.latency = False, str(e), None
+        self.checked_at = datetime.utcnow()
+
+    async def run(self):
+        while True:
+            await self.ping()
+            await asyncio.sleep(self.interval)
+
+    @property
+    def ready(self):
+        """Whether the last ping succeeded, and is recent enough to be trusted."""
+        if not self.ok or self.checked_at is None:
+            return False
+        age = (datetime.utcnow() - self.checked_at).total_seconds()
+        return age < 3 * self.interval + self.timeout
+
+    def status(self):
+        return {
+            "database": self.ready,
+            "latency_ms": self.latency * 1000 if self.latency is not None else None,
+            "error": self.error,
+            "checked_at": self.checked_at.isoformat() if self.checked_at else None,
+        }
+
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        # the app is alive as long as it answers, whatever the database
+        return self.success(data=self.application.health.status())
+
+
+class ReadyHandler(BaseHandler):
+    def get(self):
+        # ready to serve requests, i.e. the database answered recently
+        health = self.application.health
+        if not health.ready:
+            return self.error(
+                "The database is not available", data=health.status(), status=503
+            )
+        return self.success(data=health.status())
@@ -1,78 +1,506 @@
+import csv
+import hashlib
+import io
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+
+import arrow
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.orm import selectinload
 from psycopg2.errors import UniqueViolation
 from astropy.time import Time
 
 from skyportal_mma_facility.handlers.api import BaseHandler
+from skyportal_mma_facility.handlers.api.base import run_in_executor
 from skyportal_mma_facility.utils.access import auth_or_token
 from skyportal_mma_facility.utils import make_log, load_env
+from skyportal_mma_facility.utils.notifications import (
+    notify,
+    OBSERVATION_PLAN_CHANNEL,
+)
+from skyportal_mma_facility.utils.json_util import dumps
+from skyportal_mma_facility.utils.pagination import after, paginate
+from skyportal_mma_facility.utils.spool import Spool
 
 from skyportal_mma_facility.models import (
-    Telescope,
+    DBSession,
     Instrument,
     Observation,
     ObservationPlan,
+    utcnow,
 )
 
 log = make_log("obsplan")
 
 env, cfg = load_env()
 
+# plans with at least this many targets are streamed to the database with
+# COPY, smaller ones are inserted with multi-row INSERTs
+copy_threshold = cfg.get("app.copy_threshold", 5000)
+
+# marker of the NULL values in the CSV streamed with COPY
+copy_null = "\\N"
+
+# in spool mode, submitted plans are acknowledged once they are written to
+# the spool, and added to the database by the ingester service
+spool = Spool(cfg["spool.path"]) if cfg.get("spool.enabled", False) else None
+
+target_columns = [
+    "request_id",
+    "field_id",
+    "ra",
+    "dec",
+    "filter",
+    "exposure_time",
+    "program_pi",
+]
+
+
+# the validity windows are stored as datetimes, which only span the years 1
+# to 9999: MJD -678575 is 0001-01-01, and MJD 2973484 is 10000-01-01
+min_mjd = -678575
+max_mjd = 2973484
+
+# the filters of the instruments are cached, so that validating a plan
+# does not wait for the database, and refreshed after that many seconds
+instrument_filters_ttl = cfg.get("app.instrument_filters_ttl", 60)
+_instrument_filters = {}
+
+# the notifications of a plan are posted to its `callback_url`, which may
+# only point to these hosts, if set, so that a plan cannot make the
+# facility post to its internal services
+allowed_callback_hosts = cfg.get("webhooks.allowed_hosts", None)
+
+
+def get_instrument_filters(instrument_id):
+    """Return the filters of an instrument, or None if there is no such
+    instrument, from the cache if it is recent enough."""
+    cached = _instrument_filters.get(instrument_id)
+    if cached is not None and time.monotonic() - cached[1] < instrument_filters_ttl:
+        return cached[0]
+    with DBSession.session_factory() as session:
+        filters = session.scalar(
+            sa.select(Instrument.filters).where(Instrument.id == instrument_id)
+        )
+    if filters is not None:
+        _instrument_filters[instrument_id] = (filters, time.monotonic())
+    return filters
+
+
+def _invalid(message, mask):
+    """Describe the targets flagged in `mask`, or return None if there is none."""
+    indices = np.flatnonzero(mask)
+    if len(indices) == 0:
+        return None
+    return f"{message} for {len(indices)} target(s), starting with target {indices[0]}"
+
+
+def _types(values):
+    """Return the types of the values, as an array, so that they can be
+    checked all at once."""
+    return np.fromiter(map(type, values), object, len(values))
+
+
+def _numbers(values, types):
+    """Convert values to an array of floats, with NaN for the values that
+    are not numbers: only ints and floats are, not bools or numeric strings."""
+    is_number = (types == int) | (types == float)
+    if not is_number.all():
+        values = [value if ok else np.nan for value, ok in zip(values, is_number)]
+    try:
+        return np.array(values, dtype=float)
+    except OverflowError:
+        # e.g. an integer too large for a float, convert them one by one
+        numbers = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                numbers[i] = value
+            except OverflowError:
+                pass
+        return numbers
+
+
+def _integers(values, types, bits):
+    """Flag the values that are integers, and not bools, fitting in a
+    signed integer of `bits` bits, the type of their column."""
+    is_integer = types == int
+    if not is_integer.all():
+        values = [value if ok else 0 for value, ok in zip(values, is_integer)]
+    limit = 2 ** (bits - 1)
+    try:
+        integers = np.array(values, dtype=np.int64)
+    except OverflowError:
+        # e.g. an integer too large for 64 bits, check them one by one
+        return is_integer & np.fromiter(
+            (-limit <= value < limit for value in values), bool, len(values)
+        )
+    return is_integer & (integers >= -limit) & (integers < limit)
+
+
+def _strings(values):
+    """Convert values to an array of strings, with an empty string for the
+    values that are not strings."""
+    return np.array(
+        [value if isinstance(value, str) else "" for value in values], dtype=str
+    )
+
+
+def _is_callback_url(url):
+    """Whether `url` is an http(s) URL to one of the allowed hosts."""
+    if not isinstance(url, str):
+        return False
+    try:
+        parsed = urllib.parse.urlsplit(url)
+    except ValueError:
+        return False
+    if parsed.scheme not in ["http", "https"] or not parsed.hostname:
+        return False
+    return allowed_callback_hosts is None or parsed.hostname in [
+        host.lower() for host in allowed_callback_hosts
+    ]
+
+
+def validate_observation_plan(data, filters=None):
+    """Check a submitted observation plan before any database work, and
+    return all the errors found at once, or an empty list if it is valid.
+
+    The targets are checked column by column, as NumPy arrays, so that
+    plans of thousands of targets are validated in a few milliseconds.
+
+    Parameters
+    ----------
+    data : dict
+        The observation plan, as submitted by SkyPortal.
+    filters : list of str, optional
+        The filters of the instrument. If None or empty, the filters of
+        the targets are not checked.
+
+    Returns
+    -------
+    list of str
+        The errors found.
+    """
+    errors = []
+    for key in ["queue_name", "user"]:
+        if not isinstance(data.get(key), str) or data[key] == "":
+            errors.append(f"{key} must be a non-empty string")
+
+    window = data.get("validity_window_mjd")
+    if not (
+        isinstance(window, list)
+        and len(window) == 2
+        and all(
+            isinstance(mjd, (int, float)) and not isinstance(mjd, bool)
+            for mjd in window
+        )
+    ):
+        errors.append("validity_window_mjd must be a list of 2 MJDs")
+    elif not all(min_mjd <= mjd < max_mjd for mjd in window):
+        # NaN and infinities are not in the range either
+        errors.append(f"validity_window_mjd must be MJDs in [{min_mjd}, {max_mjd})")
+    elif window[0] >= window[1]:
+        errors.append("validity_window_mjd must end after it starts")
+
+    callback_url = data.get("callback_url")
+    if callback_url is not None and not _is_callback_url(callback_url):
+        if allowed_callback_hosts is None:
+            errors.append("callback_url must be an http(s) URL")
+        else:
+            errors.append(
+                "callback_url must be an http(s) URL to one of "
+                f"{', '.join(allowed_callback_hosts)}"
+            )
+
+    targets = data.get("targets")
+    if not isinstance(targets, list) or not all(
+        isinstance(target, dict) for target in targets
+    ):
+        errors.append("targets must be a list of objects")
+        return errors
+
+    columns = {
+        column: [target.get(column) for target in targets] for column in target_columns
+    }
+    types = {column: _types(values) for column, values in columns.items()}
+    missing = {column: types[column] == type(None) for column in target_columns}
+    for column in target_columns:
+        errors.append(_invalid(f"{column} is missing", missing[column]))
+
+    for column, bits in [("request_id", 32), ("field_id", 64)]:
+        errors.append(
+            _invalid(
+                f"{column} must be a {bits}-bit integer",
+                ~_integers(columns[column], types[column], bits) & ~missing[column],
+            )
+        )
+    for column in ["filter", "program_pi"]:
+        errors.append(
+            _invalid(
+                f"{column} must be a string",
+                (types[column] != str) & ~missing[column],
+            )
+        )
+
+    ra = _numbers(columns["ra"], types["ra"])
+    dec = _numbers(columns["dec"], types["dec"])
+    exposure_time = _numbers(columns["exposure_time"], types["exposure_time"])
+    # comparisons with NaN are False, so that values that are not numbers
+    # are flagged as out of range as well
+    errors.append(
+        _invalid(
+            "ra must be a number in [0, 360)",
+            ~((ra >= 0) & (ra < 360)) & ~missing["ra"],
+        )
+    )
+    errors.append(
+        _invalid(
+            "dec must be a number in [-90, 90]",
+            ~((dec >= -90) & (dec <= 90)) & ~missing["dec"],
+        )
+    )
+    errors.append(
+        _invalid(
+            "exposure_time must be a positive number",
+            ~((exposure_time > 0) & np.isfinite(exposure_time))
+            & ~missing["exposure_time"],
+        )
+    )
+    if filters:
+        errors.append(
+            _invalid(
+                f"filter must be one of {', '.join(filters)}",
+                ~np.isin(_strings(columns["filter"]), list(filters))
+                & (types["filter"] == str),
+            )
+        )
+    return [error for error in errors if error is not None]
+
+
+def copy_observations(session, rows):
+    """Stream observation rows to the database with COPY FROM STDIN, within
+    the session's transaction."""
+    # COPY bypasses the client-side defaults of the columns
+    now = session.scalar(sa.select(utcnow))
+    columns = list(rows[0]) + ["status", "created_at", "modified"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # in CSV, COPY reads an empty value as NULL unless told otherwise,
+        # so that an empty string would fail the NOT NULL constraints
+        values = [copy_null if value is None else value for value in row.values()]
+        writer.writerow(values + ["pending", now, now])
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {Observation.__tablename__} ({', '.join(columns)}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '{copy_null}')",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def hash_observation_plan(data):
+    """Return the SHA-256 of the canonical JSON of a submitted observation
+    plan, with its keys sorted and without the fields set by the API, so
+    that resubmitting the same plan gives the same hash."""
+    content = {key: value for key, value in data.items() if key != "status"}
+    return hashlib.sha256(dumps(content, sort_keys=True)).hexdigest()
+
+
+def find_observation_plans(session, queue_name, content_hash, idempotency_key=None):
+    """Return the plans a new submission could be a resubmission of, or
+    conflict with: those with the same name, content or Idempotency-Key,
+    in a single query on the indexes of these columns."""
+    condition = (ObservationPlan.queue_name == queue_name) | (
+        ObservationPlan.content_hash == content_hash
+    )
+    if idempotency_key is not None:
+        condition |= ObservationPlan.idempotency_key == idempotency_key
+    return session.execute(
+        sa.select(
+            ObservationPlan.id,
+            ObservationPlan.queue_name,
+            ObservationPlan.content_hash,
+            ObservationPlan.idempotency_key,
+        ).where(condition)
+    ).all()
+
+
+def insert_observation_plan(
+    session,
+    data,
+    instrument_id,
+    copy=None,
+    handle=None,
+    content_hash=None,
+    idempotency_key=None,
+):
+    """Add an observation plan and all of its targets to the session's
+    transaction, and notify the queue once it is committed.
+
+    The targets are inserted in bulk, with as few statements as possible,
+    rather than as one ORM object each. The caller commits.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        The session to add the plan with.
+    data : dict
+        The observation plan, as submitted by SkyPortal.
+    instrument_id : int
+        The ID of the instrument that hosts the plan.
+    copy : bool, optional
+        Whether to insert the targets with COPY. By default, COPY is used
+        for plans of at least `copy_threshold` targets.
+    handle : str, optional
+        The handle the plan was spooled with, if it was.
+    content_hash : str, optional
+        The hash of the plan, computed with `hash_observation_plan` if None.
+    idempotency_key : str, optional
+        The Idempotency-Key header the plan was submitted with, if any.
+
+    Returns
+    -------
+    int
+        The ID of the new observation plan.
+    """
+    observation_plan = ObservationPlan(
+        queue_name=data["queue_name"],
+        user=data["user"],
+        status=data["status"],
+        instrument_id=instrument_id,
+        validity_window_start=Time(
+            data["validity_window_mjd"][0], format="mjd"
+        ).datetime,
+        validity_window_end=Time(data["validity_window_mjd"][1], format="mjd").datetime,
+        payload=data,
+        handle=handle,
+        content_hash=content_hash or hash_observation_plan(data),
+        idempotency_key=idempotency_key,
+    )
+    session.add(observation_plan)
+    # get the plan's ID, without committing yet
+    session.flush()
+
+    rows = [
+        {
+            **{column: target[column] for column in target_columns},
+            "observation_plan_id": observation_plan.id,
+            "instrument_id": instrument_id,
+        }
+        for target in data["targets"]
+    ]
+    if copy is None:
+        copy = len(rows) >= copy_threshold
+    if len(rows) > 0:
+        if copy:
+            copy_observations(session, rows)
+        else:
+            # batched in pages of EXECUTEMANY_PAGESIZE rows by the engine
+            session.execute(Observation.__table__.insert(), rows)
+
+    # wake up the queue once the observations are committed
+    notify(session, OBSERVATION_PLAN_CHANNEL, observation_plan.id)
+    return observation_plan.id
+
 
 class ObservationPlanHandler(BaseHandler):
+    def replay(self, existing, content_hash, idempotency_key=None):
+        """Answer a submission conflicting with the `existing` plans, as
+        returned by `find_observation_plans`: with the ID of the plan it is
+        a retry of, or with an error."""
+        for observation_plan in existing:
+            if (
+                idempotency_key is not None
+                and observation_plan.idempotency_key == idempotency_key
+                and observation_plan.content_hash != content_hash
+            ):
+                return self.error(
+                    "This Idempotency-Key was already used for a different observation plan",
+                    status=422,
+                )
+        for observation_plan in existing:
+            if observation_plan.content_hash == content_hash:
+                self.set_header("Idempotent-Replayed", "true")
+                return self.success(data={"id": observation_plan.id})
+        return self.error("An observation plan with this name already exists")
+
     # @auth_or_token
+    @run_in_executor
     def put(self):
         data = self.get_json()
+        instrument_id = 1  # fake for now, until skyportal provides the instrument name
+        filters = get_instrument_filters(instrument_id)
+        if filters is None:
+            return self.error(f"Could not find instrument with ID {instrument_id}")
+        errors = validate_observation_plan(data, filters=filters)
+        if len(errors) > 0:
+            return self.error("Invalid observation plan", data={"errors": errors})
+
+        # a retry of a submission, e.g. after a network error, returns the
+        # plan it added the first time
+        idempotency_key = self.request.headers.get("Idempotency-Key")
+        content_hash = hash_observation_plan(data)
+
+        if spool is not None:
+            # acknowledged once on disk, the ingester adds it to the database;
+            # the handle of a retry is the same, and the ingester skips it
+            handle = content_hash
+            try:
+                spool.append(
+                    {
+                        "handle": handle,
+                        "idempotency_key": idempotency_key,
+                        "plan": {**data, "status": "pending"},
+                    }
+                )
+            except OSError as e:
+                log(f"Error spooling observation plan: {e}")
+                return self.error("Error adding observation plan")
+            return self.success(data={"handle": handle}, status=202)
 
         with self.Session() as session:
+            existing = find_observation_plans(
+                session, data["queue_name"], content_hash, idempotency_key
+            )
+            if len(existing) > 0:
+                return self.replay(existing, content_hash, idempotency_key)
+
             try:
                 data["status"] = "pending"
-                observations = data["targets"]
-
-                observation_plan = ObservationPlan(
-                    queue_name=data["queue_name"],
-                    user=data["user"],
-                    status=data["status"],
-                    instrument_id=1,  # fake for now, until skyportal provides the instrument name
-                    validity_window_start=Time(
-                        data["validity_window_mjd"][0], format="mjd"
-                    ).datetime,
-                    validity_window_end=Time(
-                        data["validity_window_mjd"][1], format="mjd"
-                    ).datetime,
-                    payload=data,
+                # the plan and its targets are committed at once
+                observation_plan_id = insert_observation_plan(
+                    session,
+                    data,
+                    instrument_id=instrument_id,
+                    content_hash=content_hash,
+                    idempotency_key=idempotency_key,
                 )
-                session.add(observation_plan)
                 session.commit()
 
-                for observation in observations:
-                    # create the observation
-                    obs = Observation(
-                        request_id=observation["request_id"],
-                        field_id=observation["field_id"],
-                        ra=observation["ra"],
-                        dec=observation["dec"],
-                        filter=observation["filter"],
-                        exposure_time=observation["exposure_time"],
-                        program_pi=observation["program_pi"],
-                        observation_plan_id=observation_plan.id,
-                        instrument_id=1,  # fake for now, until skyportal provides the instrument name
-                    )
-                    session.add(obs)
-                session.commit()
-
-                return self.success(data={"id": observation_plan.id})
+                return self.success(data={"id": observation_plan_id})
 
             except Exception as e:
                 print(e)
                 # print the attrivutes of the exception
                 session.rollback()
-                if isinstance(e.orig, UniqueViolation):
-                    return self.error(
-                        "An observation plan with this name already exists"
+                if isinstance(getattr(e, "orig", None), UniqueViolation):
+                    # the same plan, or one with the same name or key, was
+                    # added by a concurrent request since it was looked for
+                    existing = find_observation_plans(
+                        session, data["queue_name"], content_hash, idempotency_key
                     )
+                    return self.replay(existing, content_hash, idempotency_key)
                 else:
                     print(e)
                     return self.error("Error adding observation plan")
 
+    @run_in_executor
     def get(self, observation_plan_id=None):
         try:
             with self.Session() as session:
@@ -80,9 +508,15 @@ class ObservationPlanHandler(BaseHandler):
                 status = self.get_query_argument("status", None)
                 if status is not None:
                     status = status.lower()
-                    if status not in ["pending", "processing", "done", "failed"]:
+                    if status not in [
+                        "pending",
+                        "processing",
+                        "done",
+                        "failed",
+                        "missed",
+                    ]:
                         return self.error(
-                            "Status must be one of pending, processing, done, or failed"
+                            "Status must be one of pending, processing, done, failed, or missed"
                         )
 
                 if status is not None and observation_plan_id is not None:
@@ -90,27 +524,252 @@ class ObservationPlanHandler(BaseHandler):
                         "Cannot specify both status and observation plan ID"
                     )
 
-                if observation_plan_id is not None:
-                    observation_plan = session.query(ObservationPlan).get(
-                        observation_plan_id
+                try:
+                    fields = self.get_fields(ObservationPlan)
+                except ValueError as e:
+                    return self.error(str(e))
+                serialize = self.serialize_fields(fields)
+                stream = self.wants_stream()
+
+                if observation_plan_id is not None and stream:
+                    # stream the observations of the plan
+                    if session.get(ObservationPlan, observation_plan_id) is None:
+                        return self.error(
+                            f"Could not find observation plan with ID {observation_plan_id}"
+                        )
+                    return self.stream(
+                        session.query(Observation)
+                        .filter(Observation.observation_plan_id == observation_plan_id)
+                        .order_by(Observation.id)
                     )
+
+                if observation_plan_id is not None:
+                    query = self.query_fields(session, ObservationPlan, fields)
+                    if fields is None:
+                        # return the observation plan with the observations
+                        query = query.options(
+                            selectinload(ObservationPlan.observations)
+                        )
+                    observation_plan = query.filter(
+                        ObservationPlan.id == observation_plan_id
+                    ).first()
                     if observation_plan is None:
                         return self.error(
                             f"Could not find observation plan with ID {observation_plan_id}"
                         )
-                    # return the observation plan with the observations
-                    observation_plan.observations
-                    return self.success(data=observation_plan)
-                elif status is not None:
-                    observation_plans = (
-                        session.query(ObservationPlan)
-                        .filter(ObservationPlan.status == status)
-                        .all()
+                    return self.success(data=serialize(observation_plan))
+
+                try:
+                    limit = self.get_limit()
+                except ValueError as e:
+                    return self.error(str(e))
+                instrument_id = self.get_query_argument("instrument_id", None)
+                since = self.get_query_argument("since", None)
+                cursor = self.get_query_argument("cursor", None)
+
+                # the pagination key is needed to make the next cursor
+                keys = [ObservationPlan.created_at, ObservationPlan.id]
+                query = self.query_fields(session, ObservationPlan, fields, keys)
+                if status is not None:
+                    query = query.filter(ObservationPlan.status == status)
+                if instrument_id is not None:
+                    try:
+                        instrument_id = int(instrument_id)
+                    except ValueError:
+                        return self.error("Instrument ID must be an integer")
+                    query = query.filter(ObservationPlan.instrument_id == instrument_id)
+                if since is not None:
+                    try:
+                        since = arrow.get(since).to("utc").naive
+                    except Exception:
+                        return self.error(f"Invalid date {since}")
+                    query = query.filter(ObservationPlan.created_at >= since)
+
+                if stream:
+                    # stream all the plans, from the cursor on if any
+                    try:
+                        query = after(query, keys, cursor)
+                    except ValueError as e:
+                        return self.error(str(e))
+                    query = query.order_by(*keys)
+                    if self.get_query_argument("limit", None) is not None:
+                        query = query.limit(limit)
+                    return self.stream(query, serialize=serialize)
+
+                try:
+                    observation_plans, next_cursor = paginate(
+                        query, keys, cursor=cursor, limit=limit
                     )
-                    return self.success(data=observation_plans)
-                else:
-                    observation_plans = session.query(ObservationPlan).all()
-                    return self.success(data=observation_plans)
+                except ValueError as e:
+                    return self.error(str(e))
+                return self.success(
+                    data=[serialize(row) for row in observation_plans],
+                    extra={"next_cursor": next_cursor},
+                )
         except Exception as e:
             print(e)
             return self.error("Error retrieving observation plan(s)")
+
+
+observation_statuses = ["pending", "processing", "done", "failed"]
+
+
+class ObservationPlanObservationsHandler(BaseHandler):
+    @run_in_executor
+    def get(self, observation_plan_id):
+        try:
+            with self.Session() as session:
+                status = self.get_query_argument("status", None)
+                if status is not None:
+                    status = status.lower()
+                    if status not in observation_statuses:
+                        return self.error(
+                            f"Status must be one of {', '.join(observation_statuses)}"
+                        )
+                cursor = self.get_query_argument("cursor", None)
+                try:
+                    limit = self.get_limit()
+                    fields = self.get_fields(Observation)
+                except ValueError as e:
+                    return self.error(str(e))
+                serialize = self.serialize_fields(fields)
+
+                if session.get(ObservationPlan, observation_plan_id) is None:
+                    return self.error(
+                        f"Could not find observation plan with ID {observation_plan_id}"
+                    )
+
+                keys = [Observation.id]
+                query = self.query_fields(session, Observation, fields, keys)
+                query = query.filter(
+                    Observation.observation_plan_id == observation_plan_id
+                )
+                if status is not None:
+                    query = query.filter(Observation.status == status)
+
+                if self.wants_stream():
+                    try:
+                        query = after(query, keys, cursor)
+                    except ValueError as e:
+                        return self.error(str(e))
+                    return self.stream(query.order_by(*keys), serialize=serialize)
+
+                try:
+                    observations, next_cursor = paginate(
+                        query, keys, cursor=cursor, limit=limit
+                    )
+                except ValueError as e:
+                    return self.error(str(e))
+                return self.success(
+                    data=[serialize(row) for row in observations],
+                    extra={"next_cursor": next_cursor},
+                )
+        except Exception as e:
+            log(f"Error retrieving observations of plan {observation_plan_id}: {e}")
+            return self.error("Error retrieving observations")
+
+
+def summarize_observation_plan(session, observation_plan_id):
+    """Return the status of a plan, the counts and exposure times of its
+    observations by status, and an estimate of when it will be done, or
+    None if there is no such plan."""
+    # the plan and the counts of its observations, by status, in a single query
+    rows = session.execute(
+        sa.select(
+            ObservationPlan.status,
+            ObservationPlan.validity_window_end,
+            Observation.status,
+            sa.func.count(Observation.id),
+            sa.func.coalesce(sa.func.sum(Observation.exposure_time), 0.0),
+        )
+        .select_from(ObservationPlan)
+        .outerjoin(
+            Observation,
+            Observation.observation_plan_id == ObservationPlan.id,
+        )
+        .where(ObservationPlan.id == observation_plan_id)
+        .group_by(
+            ObservationPlan.id,
+            ObservationPlan.status,
+            ObservationPlan.validity_window_end,
+            Observation.status,
+        )
+    ).all()
+    if len(rows) == 0:
+        return None
+
+    counts = {status: 0 for status in observation_statuses}
+    exposure_times = {status: 0.0 for status in observation_statuses}
+    for _, _, status, count, exposure_time in rows:
+        if status is not None:
+            counts[status] = count
+            exposure_times[status] = exposure_time
+    plan_status, validity_window_end = rows[0][:2]
+
+    remaining = exposure_times["pending"] + exposure_times["processing"]
+    # a lower bound, without the overheads between observations
+    eta, eta_within_window = None, None
+    if plan_status in ["pending", "processing"]:
+        eta = datetime.utcnow() + timedelta(seconds=remaining)
+        eta_within_window = eta <= validity_window_end
+
+    return {
+        "id": int(observation_plan_id),
+        "status": plan_status,
+        "observations": sum(counts.values()),
+        "counts": counts,
+        "exposure_time": sum(exposure_times.values()),
+        "remaining_exposure_time": remaining,
+        "eta": eta,
+        "eta_within_window": eta_within_window,
+    }
+
+
+class ObservationPlanSummaryHandler(BaseHandler):
+    @run_in_executor
+    def get(self, observation_plan_id):
+        try:
+            with self.Session() as session:
+                summary = summarize_observation_plan(session, observation_plan_id)
+                if summary is None:
+                    return self.error(
+                        f"Could not find observation plan with ID {observation_plan_id}"
+                    )
+                return self.success(data=summary)
+        except Exception as e:
+            log(f"Error summarizing observation plan {observation_plan_id}: {e}")
+            return self.error("Error summarizing observation plan")
+
+
+class SpooledObservationPlanHandler(BaseHandler):
+    @run_in_executor
+    def get(self, handle):
+        # the plan is in the database once the ingester has added it
+        with self.Session() as session:
+            observation_plan = session.execute(
+                sa.select(ObservationPlan.id, ObservationPlan.status).where(
+                    ObservationPlan.handle == handle
+                )
+            ).first()
+        if observation_plan is not None:
+            return self.success(
+                data={
+                    "handle": handle,
+                    "status": "ingested",
+                    "id": observation_plan.id,
+                    "observation_plan_status": observation_plan.status,
+                }
+            )
+
+        if spool is None:
+            return self.error(f"Could not find observation plan with handle {handle}")
+        rejected = spool.rejected("handle", handle)
+        if rejected is not None:
+            return self.success(
+                data={
+                    "handle": handle,
+                    "status": "rejected",
+                    "error": rejected["error"],
+                }
+            )
+        return self.success(data={"handle": handle, "status": "spooled"})
@@ -0,0 +1,117 @@
+import json
+import time
+
+import sqlalchemy as sa
+from psycopg2.errors import UniqueViolation
+
+from skyportal_mma_facility.handlers.api.obsplan import insert_observation_plan
+from skyportal_mma_facility.models import DBSession, ObservationPlan
+from skyportal_mma_facility.utils.env import load_env
+from skyportal_mma_facility.utils.log import make_log
+
+env, cfg = load_env()
+
+log = make_log("ingester")
+
+# plans added to the database in a single transaction
+batch_size = cfg.get("spool.batch_size", 50)
+
+# seconds between two checks of the spool when it has been fully ingested
+poll_interval = cfg.get("spool.poll_interval", 0.1)
+
+# the spool is emptied once it has been fully ingested and is larger than this
+max_size = cfg.get("spool.max_size", 100_000_000)
+
+
+def ingest(session, records):
+    """Add spooled observation plans to the database, in a single
+    transaction, and return the number of plans added, and the records
+    that were rejected, with the reason why.
+
+    Each plan is added in its own savepoint, so that a rejected plan does
+    not roll the others back, and the plans that were already added, e.g.
+    before the ingester restarted or by a retry of the submission, are
+    skipped.
+    """
+    ingested = set(
+        session.scalars(
+            sa.select(ObservationPlan.handle).where(
+                ObservationPlan.handle.in_([record["handle"] for record in records])
+            )
+        )
+    )
+    added, rejected = 0, []
+    for record in records:
+        if record["handle"] in ingested:
+            continue
+        try:
+            with session.begin_nested():
+                insert_observation_plan(
+                    session,
+                    record["plan"],
+                    instrument_id=1,  # fake for now, until skyportal provides the instrument name
+                    handle=record["handle"],
+                    idempotency_key=record.get("idempotency_key"),
+                )
+            ingested.add(record["handle"])
+            added += 1
+        except Exception as e:
+            if isinstance(getattr(e, "orig", None), UniqueViolation):
+                error = (
+                    "An observation plan with this name or Idempotency-Key "
+                    "already exists"
+                )
+            else:
+                error = f"Error adding observation plan: {e}"
+            rejected.append((record, error))
+    session.commit()
+    return added, rejected
+
+
+class Ingester:
+    """Add the observation plans of a `Spool` to the database, in order,
+    `batch_size` at a time.
+
+    The offset of the spool is only moved past a batch once it is
+    committed, so that the plans of a batch are added again if the
+    ingester stops in between, and skipped then as they already are.
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+
+    def ingest_batch(self):
+        """Ingest the next batch of the spool, and return its size."""
+        lines, offset = self.spool.read(batch_size)
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                log(f"Skipping a corrupted line of the spool: {line[:100]}")
+        if len(records) > 0:
+            start = time.perf_counter()
+            with DBSession.session_factory() as session:
+                added, rejected = ingest(session, records)
+            for record, error in rejected:
+                log(f"Rejected observation plan {record['handle']}: {error}")
+                self.spool.reject(record, error)
+            log(
+                f"Ingested {added} observation plan(s) "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+        if len(lines) > 0:
+            self.spool.commit(offset)
+        return len(lines)
+
+    def run(self):
+        while True:
+            try:
+                if self.ingest_batch() > 0:
+                    continue
+                self.spool.truncate(max_size)
+            except Exception as e:
+                log(f"Error ingesting the spool, retrying in 5 seconds: {e}")
+                time.sleep(5)
+                continue
+            time.sleep(poll_interval)
@@ -2,6 +2,7 @@ from .models import *
 from .telescope import *
 from .instrument import *
 from .obs import *
+from .webhook import *
 
 from .schema import setup_schema
 
@@ -106,10 +106,19 @@ class BaseMixin:
         return f"<{type(self).__name__}({', '.join(attr_list)})>"
 
     def to_dict(self):
-        """Serialize this object to a Python dictionary."""
-        if sa.inspection.inspect(self).expired:
-            self = DBSession().merge(self)
-            DBSession().refresh(self)
+        """Serialize this object to a Python dictionary.
+
+        Only the loaded attributes are serialized, so that no query is made
+        per object: relationships have to be loaded along with the object,
+        e.g. with `selectinload`.
+        """
+        state = sa.inspection.inspect(self)
+        if state.expired:
+            # e.g. after a commit: reload it once, in its own session if any
+            if state.session is not None:
+                state.session.refresh(self)
+            else:
+                self = DBSession().merge(self)
         return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
 
 
@@ -2,7 +2,7 @@ __all__ = ["Observation", "ObservationPlan"]
 
 import sqlalchemy as sa
 from skyportal_mma_facility.models import Base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -63,6 +63,31 @@ class Observation(Base):
         doc="Status of the observation.",
     )
 
+    sequence = sa.Column(
+        sa.Integer,
+        nullable=True,
+        doc="Position of the observation in its plan, set by the scheduler to minimize slews and filter changes.",
+    )
+
+    worker = sa.Column(
+        sa.String,
+        nullable=True,
+        doc="The obsqueue worker holding the lease on the observation, if any.",
+    )
+
+    lease_expires_at = sa.Column(
+        sa.DateTime,
+        nullable=True,
+        index=True,
+        doc="UTC time after which the lease on the observation can be reclaimed by another worker.",
+    )
+
+    heartbeat_at = sa.Column(
+        sa.DateTime,
+        nullable=True,
+        doc="UTC time of the last heartbeat of the worker holding the lease.",
+    )
+
     # we want the date, exposure_time, and a completed flag
     date = sa.Column(
         sa.DateTime,
@@ -160,10 +185,41 @@ class ObservationPlan(Base):
         doc="The end of the validity window of the observation plan.",
     )
 
-    payload = sa.Column(
-        JSONB,
-        nullable=False,
-        doc="The payload of the observation plan.",
+    overhead_saved = sa.Column(
+        sa.Float,
+        nullable=True,
+        doc="Estimated slew and filter change time saved by reordering the observations, in seconds.",
+    )
+
+    # the payload duplicates the targets, stored as observations: it is
+    # only loaded when accessed, or when requested with ?fields=payload
+    payload = deferred(
+        sa.Column(
+            JSONB,
+            nullable=False,
+            doc="The payload of the observation plan.",
+        )
+    )
+
+    handle = sa.Column(
+        sa.String,
+        nullable=True,
+        unique=True,
+        doc="The handle returned when the observation plan was spooled, if it was, before being added to the database.",
+    )
+
+    content_hash = sa.Column(
+        sa.String,
+        nullable=True,
+        index=True,
+        doc="SHA-256 of the canonical JSON of the submitted observation plan, to recognize resubmissions.",
+    )
+
+    idempotency_key = sa.Column(
+        sa.String,
+        nullable=True,
+        unique=True,
+        doc="The Idempotency-Key header the observation plan was submitted with, if any.",
     )
 
     observations = relationship(
@@ -171,3 +227,8 @@ class ObservationPlan(Base):
         back_populates="observation_plan",
         doc="The Observations that are part of the Observation Plan.",
     )
+
+    # key of the pagination of the observation plans
+    __table_args__ = (
+        sa.Index("ix_observationplans_created_at_id", "created_at", "id"),
+    )
@@ -0,0 +1,72 @@
+__all__ = ["Webhook"]
+
+import sqlalchemy as sa
+from skyportal_mma_facility.models import Base, utcnow
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+class Webhook(Base):
+    """A notification waiting to be sent to the requester of an observation
+    plan, e.g. SkyPortal, written in the same transaction as the change it
+    notifies and delivered by the webhooks service."""
+
+    url = sa.Column(
+        sa.String,
+        nullable=False,
+        doc="The URL the notification is posted to.",
+    )
+
+    payload = sa.Column(
+        JSONB,
+        nullable=False,
+        doc="The content of the notification.",
+    )
+
+    status = sa.Column(
+        sa.String,
+        nullable=False,
+        default="pending",
+        doc="Status of the delivery: pending, sent, or failed once it was attempted too many times.",
+    )
+
+    attempts = sa.Column(
+        sa.Integer,
+        nullable=False,
+        default=0,
+        doc="The number of delivery attempts.",
+    )
+
+    next_attempt_at = sa.Column(
+        sa.DateTime,
+        nullable=False,
+        default=utcnow,
+        doc="UTC time of the next delivery attempt, pushed back after each failure.",
+    )
+
+    last_error = sa.Column(
+        sa.String,
+        nullable=True,
+        doc="The error of the last failed delivery attempt.",
+    )
+
+    sent_at = sa.Column(
+        sa.DateTime,
+        nullable=True,
+        doc="UTC time the notification was delivered.",
+    )
+
+    observation_plan_id = sa.Column(
+        sa.ForeignKey("observationplans.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+        doc="The ID of the Observation Plan the notification is about.",
+    )
+
+    # the deliveries still to attempt, by due time
+    __table_args__ = (
+        sa.Index(
+            "ix_webhooks_pending_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=sa.text("status = 'pending'"),
+        ),
+    )
@@ -0,0 +1,675 @@
+import json
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import asyncio
+import sqlalchemy as sa
+from astropy.time import Time
+
+from skyportal_mma_facility.models import (
+    Instrument,
+    ObservationPlan,
+    Observation,
+    utcnow,
+)
+from skyportal_mma_facility.utils.env import load_env
+from skyportal_mma_facility.utils.log import make_log
+from skyportal_mma_facility.utils.model_util import run_in_db_thread
+from skyportal_mma_facility.utils.notifications import (
+    Listener,
+    OBSERVATION_CHANNEL,
+    OBSERVATION_PLAN_CHANNEL,
+    notify,
+)
+from skyportal_mma_facility.utils.scheduling import optimize_order
+from skyportal_mma_facility.webhook_server import enqueue_webhook
+
+env, cfg = load_env()
+
+log = make_log("obsqueue")
+
+# new plans wake the queue up through a notification, so polling the
+# database is only a fallback in case a notification is ever missed
+poll_interval = cfg.get("obsqueue.poll_interval", 60)
+
+# number of observations a lane loads ahead of the one being processed
+queue_size = cfg.get("obsqueue.queue_size", 10)
+
+# number of observations each lane processes at the same time, which can
+# be overridden per instrument name, e.g. for instruments with several
+# detectors or for simulated facilities
+concurrency = cfg.get("obsqueue.concurrency", 1)
+
+# used to order the observations of a plan, to minimize the time
+# spent slewing and changing filters between two observations
+slew_rate = cfg.get("obsqueue.slew_rate", 2.0)
+filter_change_time = cfg.get("obsqueue.filter_change_time", 30.0)
+
+# seconds between two status reports of the lanes
+status_interval = cfg.get("obsqueue.status_interval", 300)
+
+# several workers can run side by side: observations are leased to the
+# worker that claims them, and the leases are renewed by a heartbeat, so
+# that the observations of a crashed worker are reclaimed once they expire
+worker_id = f"{socket.gethostname()}:{os.getpid()}"
+lease_duration = timedelta(seconds=cfg.get("obsqueue.lease_duration", 60))
+
+claimable = (Observation.status == "pending") | (
+    (Observation.status == "processing") & (Observation.lease_expires_at < utcnow)
+)
+
+# plans are run earliest deadline first: the plans that can still be completed
+# within their validity window come first, by increasing slack (seconds left
+# in the window minus the exposure time of the observations left to do)
+remaining_exposure = (
+    sa.select(sa.func.coalesce(sa.func.sum(Observation.exposure_time), 0.0))
+    .where(
+        (Observation.observation_plan_id == ObservationPlan.id)
+        & Observation.status.in_(["pending", "processing"])
+    )
+    .correlate(ObservationPlan)
+    .scalar_subquery()
+)
+slack = (
+    sa.extract("epoch", ObservationPlan.validity_window_end - utcnow)
+    - remaining_exposure
+)
+urgency = [slack < 0, slack, ObservationPlan.created_at]
+
+# whether a lane switches to a more urgent plan between two observations
+preemption = cfg.get("obsqueue.preemption", True)
+
+# the lanes share a single event loop, so their (blocking) database work
+# runs in a pool of threads, for a slow database not to stall the
+# observations in flight
+db_executor = ThreadPoolExecutor(
+    max_workers=cfg.get("obsqueue.db_threads", 10),
+    thread_name_prefix="obsqueue-db",
+)
+
+
+def notify_status(session, observation_plan_id, status, observation_ids=None):
+    """Notify a status change of a plan, or of some of its observations,
+    within the session's transaction, e.g. to stream it to API clients."""
+    payload = {"observation_plan_id": observation_plan_id, "status": status}
+    if observation_ids is not None:
+        payload["observation_ids"] = list(observation_ids)
+    notify(session, OBSERVATION_CHANNEL, json.dumps(payload))
+
+
+def expire_plans(session, instrument_id=None):
+    """Label all the plans (of an instrument) whose validity window is
+    over as missed, in a single statement."""
+    stmt = (
+        sa.update(ObservationPlan)
+        .where(
+            ObservationPlan.status.in_(["pending", "processing"])
+            & (ObservationPlan.validity_window_end < utcnow)
+        )
+        .values(status="missed")
+        .returning(ObservationPlan.id)
+        .execution_options(synchronize_session=False)
+    )
+    if instrument_id is not None:
+        stmt = stmt.where(ObservationPlan.instrument_id == instrument_id)
+    plan_ids = session.scalars(stmt).all()
+    for plan_id in plan_ids:
+        notify_status(session, plan_id, "missed")
+    session.commit()
+    if len(plan_ids) > 0:
+        log(f"Missed observation plan(s) {', '.join(map(str, plan_ids))}")
+    return plan_ids
+
+
+class ObservationPlanQueue(asyncio.Queue):
+    """Scheduling lane of a single instrument.
+
+    A lane runs one observation plan at a time on its instrument: `feed`
+    leases the observations of the plan and puts them into the queue,
+    waiting while the queue is full, and `service` processes them as they
+    come, up to `concurrency` at a time. Lanes of different instruments
+    run concurrently in the same event loop.
+    """
+
+    def __init__(self, instrument_id, driver, maxsize=0, concurrency=1):
+        super().__init__(maxsize)
+        self.instrument_id = instrument_id
+        self.driver = driver
+        self.concurrency = concurrency
+        self.log = make_log(f"obsqueue:{instrument_id}")
+        self._obsplan_id = None
+        self._new_plan = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._current = set()
+        self._overhead_saved = None
+        self._processed = 0
+        self._failed = 0
+
+    def wake_up(self):
+        self._new_plan.set()
+
+    async def wait_for_plan(self, timeout):
+        """Wait until a new plan is notified, or `timeout` seconds have passed."""
+        try:
+            await asyncio.wait_for(self._new_plan.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def status(self):
+        return {
+            "instrument_id": self.instrument_id,
+            "observation_plan_id": self._obsplan_id,
+            "current": sorted(self._current),
+            "overhead_saved": self._overhead_saved,
+            "queued": self.qsize(),
+            "processed": self._processed,
+            "failed": self._failed,
+        }
+
+    def eligible_plans(self, query):
+        """Filter `query` on the plans of this instrument that are pending, or
+        that are processing but still have observations to claim (e.g. from
+        a crashed or preempted worker), most urgent first."""
+        return (
+            query.filter(ObservationPlan.instrument_id == self.instrument_id)
+            .filter(
+                (ObservationPlan.status == "pending")
+                | (
+                    (ObservationPlan.status == "processing")
+                    & sa.exists().where(
+                        (Observation.observation_plan_id == ObservationPlan.id)
+                        & claimable
+                    )
+                )
+            )
+            .filter(ObservationPlan.validity_window_start < datetime.utcnow())
+            .filter(ObservationPlan.validity_window_end >= datetime.utcnow())
+            .order_by(*urgency)
+        )
+
+    async def load_plan(self):
+        self.log("Loading observation plan")
+        # clear before querying, so that a plan committed after the
+        # query still wakes us up
+        self._new_plan.clear()
+        plan = await run_in_db_thread(db_executor, self.lease_plan)
+        if plan is None:
+            # nothing to do, wait for a new plan to be notified
+            return False, poll_interval
+
+        # add the observation plan to the queue
+        self._obsplan_id, queue_name, self._overhead_saved = plan
+        self.log(f"Added {queue_name} to the queue")
+        return True, 0
+
+    def lease_plan(self, session):
+        """Set the most urgent plan of this instrument to processing, and
+        return its ID, queue name and overhead saved, or None if there is
+        no plan to run."""
+        # skip the plans that are not valid anymore, all at once
+        expire_plans(session, instrument_id=self.instrument_id)
+        # get the most urgent observation plan of this instrument, skipping
+        # the plans other workers are updating right now
+        observation_plan = (
+            self.eligible_plans(session.query(ObservationPlan))
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if observation_plan is None:
+            session.rollback()
+            return None
+
+        if observation_plan.status == "pending":
+            self.schedule(session, observation_plan)
+        # set the observation plan to processing
+        observation_plan.status = "processing"
+        notify_status(session, observation_plan.id, "processing")
+        session.commit()
+        return (
+            observation_plan.id,
+            observation_plan.queue_name,
+            observation_plan.overhead_saved,
+        )
+
+    def schedule(self, session, observation_plan):
+        """Order the observations of a plan to minimize the slews and filter
+        changes, starting from the zenith if the telescope location is known."""
+        observations = (
+            session.query(
+                Observation.id, Observation.ra, Observation.dec, Observation.filter
+            )
+            .filter(Observation.observation_plan_id == observation_plan.id)
+            .order_by(Observation.id)
+            .all()
+        )
+        if len(observations) == 0:
+            return
+        ids, ra, dec, filters = zip(*observations)
+
+        start = None
+        telescope = observation_plan.instrument.telescope
+        if telescope.lat is not None and telescope.lon is not None:
+            # local mean sidereal time, i.e. the RA of the zenith
+            lst = (
+                280.46061837
+                + 360.98564736629 * (Time.now().jd - 2451545.0)
+                + telescope.lon
+            ) % 360
+            start = (lst, telescope.lat)
+
+        order, overhead_before, overhead_after = optimize_order(
+            ra,
+            dec,
+            filters,
+            start=start,
+            slew_rate=slew_rate,
+            filter_change_time=filter_change_time,
+        )
+        session.execute(
+            sa.update(Observation),
+            [
+                {"id": ids[index], "sequence": sequence}
+                for sequence, index in enumerate(order)
+            ],
+        )
+        observation_plan.overhead_saved = overhead_before - overhead_after
+        self.log(
+            f"Scheduled {len(ids)} observations of {observation_plan.queue_name}, "
+            f"saving an estimated {overhead_before - overhead_after:.0f}s "
+            f"of overhead ({overhead_after:.0f}s instead of {overhead_before:.0f}s)"
+        )
+
+    async def load_queue(self):
+        """Lease the next observations of the current plan, and queue them.
+
+        Observations that are leased by another worker are skipped, so that
+        several workers can drain the same plan. Returns the number of
+        observations that were leased.
+        """
+        limit = max(1, self.maxsize - self.qsize())
+        observation_ids = await run_in_db_thread(
+            db_executor, self.lease_observations, self._obsplan_id, limit
+        )
+        for observation_id in observation_ids:
+            await self.put(observation_id)
+        return len(observation_ids)
+
+    def lease_observations(self, session, obsplan_id, limit):
+        """Lease up to `limit` observations of a plan, in sequence order,
+        and return their IDs."""
+        observation_ids = (
+            sa.select(Observation.id)
+            .where(
+                (Observation.observation_plan_id == obsplan_id)
+                & claimable
+                # e.g. the plan was missed while it was running
+                & Observation.observation_plan.has(
+                    ObservationPlan.status == "processing"
+                )
+            )
+            .order_by(Observation.sequence, Observation.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        observation_ids = session.scalars(
+            sa.update(Observation)
+            .where(Observation.id.in_(observation_ids))
+            .values(
+                status="processing",
+                worker=worker_id,
+                lease_expires_at=utcnow + lease_duration,
+                heartbeat_at=utcnow,
+            )
+            .returning(Observation.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(observation_ids) > 0:
+            notify_status(session, obsplan_id, "processing", observation_ids)
+        session.commit()
+        return observation_ids
+
+    async def preempt(self):
+        """Switch to the most urgent plan if it can still be completed in time,
+        but would not be if it had to wait for the current plan to be done.
+
+        The observations waiting in the queue are given back, so that the
+        current plan can be resumed later on, by this or another worker.
+        Returns whether the current plan was preempted.
+        """
+        urgent = await run_in_db_thread(
+            db_executor, self.more_urgent_plan, self._obsplan_id
+        )
+        if urgent is None:
+            return False
+
+        remaining, (plan_id, plan_slack) = urgent
+        self.log(
+            f"Preempting observation plan {self._obsplan_id} "
+            f"({remaining:.0f}s of exposure left) for plan {plan_id} "
+            f"(slack: {plan_slack:.0f}s)"
+        )
+        observation_ids = []
+        while not self.empty():
+            observation_ids.append(self.get_nowait())
+            self.task_done()
+        await run_in_db_thread(db_executor, self.give_back, observation_ids)
+        self._obsplan_id = None
+        return True
+
+    def more_urgent_plan(self, session, obsplan_id):
+        """Return the exposure left in a plan and the (ID, slack) of the plan
+        that should preempt it, or None if it should keep running."""
+        remaining = (
+            session.query(remaining_exposure)
+            .filter(ObservationPlan.id == obsplan_id)
+            .scalar()
+        )
+        best = self.eligible_plans(session.query(ObservationPlan.id, slack)).first()
+        if remaining is None or best is None or best[0] == obsplan_id:
+            return None
+        if not 0 <= best[1] < remaining:
+            return None
+        return remaining, tuple(best)
+
+    def give_back(self, session, observation_ids):
+        """Release the leases of observations that were not processed."""
+        rows = session.execute(
+            sa.update(Observation)
+            .where(
+                Observation.id.in_(observation_ids) & (Observation.worker == worker_id)
+            )
+            .values(status="pending", worker=None, lease_expires_at=None)
+            .returning(Observation.observation_plan_id, Observation.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        plans = {}
+        for plan_id, observation_id in rows:
+            plans.setdefault(plan_id, []).append(observation_id)
+        for plan_id, ids in plans.items():
+            notify_status(session, plan_id, "pending", ids)
+        session.commit()
+
+    async def complete_plan(self):
+        if await run_in_db_thread(db_executor, self.close_plan, self._obsplan_id):
+            self.log(f"Done with observation plan {self._obsplan_id}")
+        # set the current plan to None
+        self._obsplan_id = None
+
+    def close_plan(self, session, obsplan_id):
+        """Label a plan as done, unless other workers are still processing
+        some of its observations: the last one will close it. Returns
+        whether the plan was closed."""
+        result = session.execute(
+            sa.update(ObservationPlan)
+            .where(
+                (ObservationPlan.id == obsplan_id)
+                & (ObservationPlan.status == "processing")
+                & ~sa.exists().where(
+                    (Observation.observation_plan_id == ObservationPlan.id)
+                    & Observation.status.in_(["pending", "processing"])
+                )
+            )
+            .values(status="done")
+            .execution_options(synchronize_session=False)
+        )
+        closed = result.rowcount > 0
+        if closed:
+            notify_status(session, obsplan_id, "done")
+        session.commit()
+        return closed
+
+    async def feed(self):
+        while True:
+            try:
+                if self._obsplan_id is None:
+                    loaded_new_plan, timeout = await self.load_plan()
+                    if not loaded_new_plan:
+                        if timeout > 0:
+                            await self.wait_for_plan(timeout)
+                        continue
+
+                if preemption and await self.preempt():
+                    continue
+                leased = await self.load_queue()
+
+                if leased == 0:
+                    # nothing left to lease: wait for the observations
+                    # in flight to be processed before closing the plan
+                    await self.join()
+                    await self.complete_plan()
+            except Exception as e:
+                self.log(f"Error loading observation plan: {e}")
+                self._obsplan_id = None
+                await asyncio.sleep(5)
+
+    async def service(self):
+        tasks = set()
+        while True:
+            # wait for a free slot before taking the next observation,
+            # so that the others stay in the queue for `feed` to see
+            await self._slots.acquire()
+            item = await self.get()
+            self._current.add(item)
+            task = asyncio.create_task(self.observe(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def observe(self, item):
+        try:
+            self.log(f"Got {item} from the queue")
+            await self.processing(item)
+            self._processed += 1
+        except Exception as e:
+            self.log(f"Error processing observation {item}: {e}")
+            self._failed += 1
+            try:
+                await run_in_db_thread(db_executor, self.release, item, "failed")
+            except Exception as e:
+                self.log(f"Error releasing observation {item}: {e}")
+        finally:
+            self._current.discard(item)
+            self._slots.release()
+            self.task_done()
+
+    def release(self, session, item, status, values=None):
+        """Set the final status of a leased observation (and any other
+        `values`, keyed by column), then release the lease."""
+        values = values or {}
+        plan_id = session.scalar(
+            sa.update(Observation)
+            .where((Observation.id == item) & (Observation.worker == worker_id))
+            .values(
+                {
+                    Observation.status: status,
+                    Observation.worker: None,
+                    Observation.lease_expires_at: None,
+                    **values,
+                }
+            )
+            .returning(Observation.observation_plan_id)
+            .execution_options(synchronize_session=False)
+        )
+        if plan_id is None:
+            session.rollback()
+            self.log(f"Lost the lease on observation {item}")
+            return
+        notify_status(session, plan_id, status, [item])
+        # let the requester know, once the change is committed
+        enqueue_webhook(session, item)
+        session.commit()
+
+    def get_observation(self, session, item):
+        """Return the observation, detached from the session, or None if
+        its lease expired while it was waiting in the queue."""
+        obs = session.get(Observation, item)
+        if obs is None or obs.worker != worker_id:
+            return None
+        session.expunge(obs)
+        return obs
+
+    async def processing(self, item):
+        # the session is closed before the observation starts, so that
+        # no connection is held while waiting for the facility
+        obs = await run_in_db_thread(db_executor, self.get_observation, item)
+        if obs is None:
+            self.log(f"Lost the lease on observation {item}, skipping it")
+            return
+
+        self.log(f"Processing {obs.id}")
+        # trigger the observation on the facility, and wait for the result
+        path = await self.driver.observe(obs)
+
+        await run_in_db_thread(
+            db_executor,
+            self.release,
+            item,
+            "done",
+            {Observation._fits_path: path, Observation.date: utcnow},
+        )
+
+
+class ObservationScheduler:
+    """Dispatch observation plans to one `ObservationPlanQueue` per instrument.
+
+    The scheduler looks for instruments that have plans to run, starts a
+    lane for each of them, and wakes the lanes up when new plans come in.
+    The lanes perform their observations with `driver`, a
+    `skyportal_mma_facility.facility.FacilityDriver`.
+    """
+
+    lane_class = ObservationPlanQueue
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.lanes = {}
+        self._new_plan = asyncio.Event()
+
+    def on_notification(self, channel, payload):
+        self._new_plan.set()
+
+    def complete_plans(self, session):
+        """Close the plans whose observations were all processed, e.g. when
+        the worker processing the last ones crashed before closing them."""
+        plan_ids = session.scalars(
+            sa.update(ObservationPlan)
+            .where(
+                (ObservationPlan.status == "processing")
+                & ~sa.exists().where(
+                    (Observation.observation_plan_id == ObservationPlan.id)
+                    & Observation.status.in_(["pending", "processing"])
+                )
+            )
+            .values(status="done")
+            .returning(ObservationPlan.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for plan_id in plan_ids:
+            notify_status(session, plan_id, "done")
+        session.commit()
+        for plan_id in plan_ids:
+            log(f"Done with observation plan {plan_id}")
+
+    def refresh(self, session):
+        """Expire and close the plans that are over, and return the (ID, name)
+        of the instruments that have plans to run."""
+        expire_plans(session)
+        self.complete_plans(session)
+        return (
+            session.query(Instrument.id, Instrument.name)
+            .join(ObservationPlan, ObservationPlan.instrument_id == Instrument.id)
+            .filter(
+                (ObservationPlan.status == "pending")
+                | (ObservationPlan.status == "processing")
+            )
+            .distinct()
+            .all()
+        )
+
+    def add_lanes(self, instruments):
+        for instrument_id, name in instruments:
+            if instrument_id in self.lanes:
+                continue
+            instrument_concurrency = cfg.get(
+                f"obsqueue.instruments.{name}.concurrency", concurrency
+            )
+            lane = self.lane_class(
+                instrument_id,
+                self.driver,
+                maxsize=max(queue_size, instrument_concurrency),
+                concurrency=instrument_concurrency,
+            )
+            self.lanes[instrument_id] = lane
+            asyncio.create_task(lane.feed())
+            asyncio.create_task(lane.service())
+            log(
+                f"Started the queue of instrument {name} ({instrument_id}), "
+                f"running {instrument_concurrency} observation(s) at a time"
+            )
+
+    async def service(self):
+        while True:
+            self._new_plan.clear()
+            try:
+                instruments = await run_in_db_thread(db_executor, self.refresh)
+                self.add_lanes(instruments)
+            except Exception as e:
+                log(f"Error looking for observation plans: {e}")
+
+            for lane in self.lanes.values():
+                lane.wake_up()
+
+            try:
+                await asyncio.wait_for(self._new_plan.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def renew_leases(self, session):
+        """Extend the leases of the observations held by this worker."""
+        session.execute(
+            sa.update(Observation)
+            .where(
+                (Observation.worker == worker_id) & (Observation.status == "processing")
+            )
+            .values(
+                lease_expires_at=utcnow + lease_duration,
+                heartbeat_at=utcnow,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(lease_duration.total_seconds() / 3)
+            try:
+                await run_in_db_thread(db_executor, self.renew_leases)
+            except Exception as e:
+                log(f"Error renewing the leases: {e}")
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(status_interval)
+            for lane in self.lanes.values():
+                status = lane.status()
+                lane.log(
+                    f"plan: {status['observation_plan_id']}, "
+                    f"current: {status['current']}, "
+                    f"queued: {status['queued']}, "
+                    f"processed: {status['processed']}, "
+                    f"failed: {status['failed']}"
+                )
+
+    def start(self, engine):
+        """Start the scheduler in the current event loop, listening for
+        new plans on `engine`'s database."""
+        self.listener = Listener(
+            engine, [OBSERVATION_PLAN_CHANNEL], self.on_notification
+        )
+        self.listener.start()
+        self.tasks = [
+            asyncio.create_task(self.service()),
+            asyncio.create_task(self.heartbeat()),
+            asyncio.create_task(self.report()),
+        ]
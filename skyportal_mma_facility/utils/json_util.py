@@ -1,6 +1,8 @@
 from datetime import date, datetime
 
+import orjson
 import simplejson as json
+import sqlalchemy as sa
 from arrow.arrow import Arrow
 
 # from sqlalchemy_utils import PhoneNumber
@@ -52,3 +54,44 @@ class Encoder(json.JSONEncoder):
 
 def to_json(obj):
     return json.dumps(obj, cls=Encoder, indent=2, ignore_nan=True)
+
+
+# public attributes of each model, computed once per class
+_model_fields = {}
+
+
+def _fields(cls):
+    fields = _model_fields.get(cls)
+    if fields is None:
+        fields = [
+            attr.key for attr in sa.inspect(cls).attrs if not attr.key.startswith("_")
+        ]
+        _model_fields[cls] = fields
+    return fields
+
+
+def _default(o):
+    """Serialize the objects orjson does not handle natively."""
+    if hasattr(o, "__table__"):  # SQLAlchemy model
+        if sa.inspect(o).expired:
+            return o.to_dict()
+        # only the loaded attributes, as in `BaseMixin.to_dict`
+        attributes = o.__dict__
+        return {k: attributes[k] for k in _fields(type(o)) if k in attributes}
+    return Encoder().default(o)
+
+
+def dumps(obj, pretty=False, sort_keys=False):
+    """Serialize `obj` to compact JSON bytes, or indented if `pretty`, and
+    with the keys of the objects sorted if `sort_keys`, e.g. to hash it.
+
+    Much faster than `to_json`: the encoding is done by orjson, which
+    handles datetimes and numpy arrays natively, and models are converted
+    to dictionaries from a list of attributes computed once per class.
+    """
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=_default, option=option)
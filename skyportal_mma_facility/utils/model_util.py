@@ -1,3 +1,4 @@
+import asyncio
 import time
 from contextlib import contextmanager
 
@@ -23,6 +24,20 @@ def status(message):
         models.DBSession().commit()
 
 
+async def run_in_db_thread(executor, func, *args):
+    """Run `func(session, *args)` in a pool of threads, with a new session
+    that is closed once it returns, and return its result.
+
+    Used by the services whose event loop must not wait for the database.
+    """
+
+    def run():
+        with models.DBSession.session_factory() as session:
+            return func(session, *args)
+
+    return await asyncio.get_running_loop().run_in_executor(executor, run)
+
+
 def drop_tables():
     conn = models.DBSession.session_factory.kw["bind"]
     print(f"Dropping tables on database {conn.url.database}")
@@ -0,0 +1,156 @@
+"""
+Postgres LISTEN/NOTIFY helpers, used to wake services up as soon as
+the rows they are waiting for have been committed.
+"""
+
+import asyncio
+import json
+
+import sqlalchemy as sa
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from skyportal_mma_facility.utils.log import make_log
+
+log = make_log("notifications")
+
+OBSERVATION_PLAN_CHANNEL = "observationplans"
+
+# status changes of the observations and plans, with a JSON payload, e.g.
+# {"observation_plan_id": 1, "observation_ids": [1, 2], "status": "done"}
+OBSERVATION_CHANNEL = "observations"
+
+# new notifications in the outbox of the webhooks service
+WEBHOOK_CHANNEL = "webhooks"
+
+
+def notify(session, channel, payload=""):
+    """Queue a notification on `channel` within the session's transaction.
+
+    Postgres only delivers the notification once the transaction commits,
+    and drops it if the transaction is rolled back, so listeners never
+    wake up for rows they cannot see yet.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        The session whose transaction carries the notification.
+    channel : str
+        Name of the channel to notify.
+    payload : str, optional
+        Payload of the notification, e.g. the ID of the new row.
+    """
+    session.execute(
+        sa.text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": channel, "payload": str(payload)},
+    )
+
+
+class Listener:
+    """LISTEN on one or more channels from within an asyncio event loop.
+
+    The listener holds a dedicated connection, detached from the engine's
+    pool, and registers its socket with the event loop so that `callback`
+    is called with `(channel, payload)` as soon as a notification arrives.
+    If the connection is lost, it reconnects every `retry` seconds.
+    """
+
+    def __init__(self, engine, channels, callback, retry=5):
+        self.engine = engine
+        self.channels = list(channels)
+        self.callback = callback
+        self.retry = retry
+        self._conn = None
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        try:
+            raw = self.engine.raw_connection()
+            conn = raw.driver_connection
+            raw.detach()
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                for channel in self.channels:
+                    cursor.execute(f'LISTEN "{channel}"')
+        except Exception as e:
+            log(f"Could not listen on {', '.join(self.channels)}: {e}")
+            loop.call_later(self.retry, self.start)
+            return
+
+        self._conn = conn
+        loop.add_reader(conn.fileno(), self._on_readable)
+        log(f"Listening on {', '.join(self.channels)}")
+
+    def stop(self):
+        if self._conn is not None:
+            try:
+                asyncio.get_event_loop().remove_reader(self._conn.fileno())
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except Exception as e:
+            log(f"Lost the notification connection: {e}")
+            self.stop()
+            asyncio.get_event_loop().call_later(self.retry, self.start)
+            return
+
+        while self._conn.notifies:
+            notification = self._conn.notifies.pop(0)
+            try:
+                self.callback(notification.channel, notification.payload)
+            except Exception as e:
+                log(f"Error handling notification on {notification.channel}: {e}")
+
+
+class Subscription:
+    """Events of a key, published by a `Broker`, waiting to be consumed."""
+
+    def __init__(self, key, maxsize=1000):
+        self.key = key
+        self.queue = asyncio.Queue(maxsize)
+        # set if events were dropped because they were not consumed in time
+        self.overflow = False
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    """Fan the notifications of a channel out to many subscribers, from a
+    single `Listener`.
+
+    The payloads are JSON objects, and each subscriber gets the ones whose
+    `key` field has the value it subscribed to, e.g. the status changes
+    of a given observation plan.
+    """
+
+    def __init__(self, engine, channel, key):
+        self.key = key
+        self.subscriptions = {}
+        self.listener = Listener(engine, [channel], self.publish)
+
+    def start(self):
+        self.listener.start()
+
+    def subscribe(self, key):
+        subscription = Subscription(key)
+        self.subscriptions.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscriptions.get(subscription.key, set())
+        subscriptions.discard(subscription)
+        if len(subscriptions) == 0:
+            self.subscriptions.pop(subscription.key, None)
+
+    def publish(self, channel, payload):
+        event = json.loads(payload)
+        for subscription in self.subscriptions.get(event.get(self.key), ()):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflow = True
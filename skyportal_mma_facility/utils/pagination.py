@@ -0,0 +1,82 @@
+"""
+Keyset pagination: pages are delimited by the sort key of their last row
+rather than by an offset, so that fetching a page costs the same however
+deep into the results it is, and rows added meanwhile are not skipped.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+import sqlalchemy as sa
+
+
+def encode_cursor(values):
+    """Encode the sort key of a row into an opaque, URL-safe token."""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    """Decode a token made by `encode_cursor` into the values of `columns`.
+
+    Raises a ValueError if the token is not a valid cursor for these columns.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [
+            datetime.fromisoformat(value)
+            if isinstance(column.type, sa.DateTime)
+            else value
+            for column, value in zip(columns, values)
+        ]
+    except Exception:
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def after(query, columns, cursor):
+    """Filter `query` on the rows that come after `cursor` when ordered by
+    `columns`, or return it as is if `cursor` is None."""
+    if cursor is None:
+        return query
+    values = [
+        sa.literal(value, column.type)
+        for column, value in zip(columns, decode_cursor(cursor, columns))
+    ]
+    return query.filter(sa.tuple_(*columns) > sa.tuple_(*values))
+
+
+def paginate(query, columns, cursor=None, limit=100):
+    """Return a page of the results of `query`, ordered by `columns`.
+
+    Parameters
+    ----------
+    query : sqlalchemy.orm.Query
+        The query to paginate, without ordering nor limit.
+    columns : list of sqlalchemy.Column
+        Columns that uniquely identify a row, e.g. (created_at, id), ideally
+        covered by an index.
+    cursor : str, optional
+        Token returned with the previous page. If None, the first page
+        is returned.
+    limit : int, optional
+        Maximum number of rows in the page.
+
+    Returns
+    -------
+    rows : list
+        The rows of the page.
+    next_cursor : str or None
+        Token to get the next page, or None if this page is the last one.
+    """
+    query = after(query, columns, cursor)
+    # fetch one more row to know whether there is a next page
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return rows, next_cursor
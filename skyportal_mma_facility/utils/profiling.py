@@ -0,0 +1,79 @@
+"""
+Helpers to measure the database work done by a piece of code.
+"""
+
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+
+class QueryCounter:
+    """Count the database round trips made through an engine.
+
+    Every statement sent to the database is counted (an executemany that
+    is split into several batches counts once per batch), as well as every
+    commit, e.g.::
+
+        with QueryCounter(engine) as counter:
+            do_something()
+        print(counter.statements, counter.commits, counter.round_trips)
+
+    The statements themselves are kept in `queries`.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The engine to watch.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+        self.commits = 0
+        self.queries = []
+
+    @property
+    def round_trips(self):
+        return self.statements + self.commits
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        self.queries.append(statement)
+
+    def _on_commit(self, conn):
+        self.commits += 1
+
+    def __enter__(self):
+        sa.event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        sa.event.listen(self.engine, "commit", self._on_commit)
+        return self
+
+    def __exit__(self, *exc):
+        sa.event.remove(self.engine, "before_cursor_execute", self._on_execute)
+        sa.event.remove(self.engine, "commit", self._on_commit)
+
+
+@contextmanager
+def assert_max_queries(engine, limit):
+    """Fail if the code in the block sends more than `limit` statements,
+    e.g. to check that listing objects makes a fixed number of queries
+    whatever the number of objects, rather than lazy loading their
+    relationships one object at a time::
+
+        with assert_max_queries(engine, 2):
+            session.query(Telescope).options(selectinload(Telescope.instruments)).all()
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The engine to watch.
+    limit : int
+        Maximum number of statements.
+    """
+    with QueryCounter(engine) as counter:
+        yield counter
+    if counter.statements > limit:
+        raise AssertionError(
+            f"{counter.statements} statements were executed, expected at most "
+            f"{limit}:\n" + "\n".join(counter.queries)
+        )
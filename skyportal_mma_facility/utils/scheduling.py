@@ -0,0 +1,257 @@
+"""
+Ordering of the observations of a plan, to minimize the dead time spent
+slewing the telescope and changing filters between two exposures, and
+simulation of the policies used to choose which plan to run next.
+"""
+
+import numpy as np
+
+
+def angular_distance(ra1, dec1, ra2, dec2):
+    """Angular distance in degrees between (arrays of) sky positions in
+    degrees, using the haversine formula."""
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+    a = (
+        np.sin((dec2 - dec1) / 2) ** 2
+        + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    )
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+
+def transition_costs(ra, dec, filters, i, j, slew_rate, filter_change_time):
+    """Overhead in seconds of going from observations `i` to observations `j`."""
+    slew = angular_distance(ra[i], dec[i], ra[j], dec[j]) / slew_rate
+    return slew + filter_change_time * (filters[i] != filters[j])
+
+
+def path_overhead(order, ra, dec, filters, slew_rate, filter_change_time):
+    """Total overhead in seconds of observing in the given order. The first
+    entry is the starting position, whose filter is ignored."""
+    order = np.asarray(order)
+    if len(order) < 2:
+        return 0.0
+    costs = transition_costs(
+        ra, dec, filters, order[:-1], order[1:], slew_rate, filter_change_time
+    )
+    # the filter in place at the start is unknown
+    if filters[order[0]] is None:
+        costs[0] = (
+            angular_distance(ra[order[0]], dec[order[0]], ra[order[1]], dec[order[1]])
+            / slew_rate
+        )
+    return float(np.sum(costs))
+
+
+def nearest_neighbour(ra, dec, filters, slew_rate, filter_change_time):
+    """Greedy path starting at index 0, always going to the cheapest
+    observation not visited yet."""
+    n = len(ra)
+    order = np.empty(n, dtype=int)
+    order[0] = 0
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    current = 0
+    for step in range(1, n):
+        costs = transition_costs(
+            ra, dec, filters, current, np.arange(n), slew_rate, filter_change_time
+        )
+        costs[visited] = np.inf
+        current = int(np.argmin(costs))
+        order[step] = current
+        visited[current] = True
+    return order
+
+
+def two_opt(order, costs, max_iterations=1000):
+    """Improve an open path with a fixed start by reversing segments, as
+    long as doing so shortens the path.
+
+    Parameters
+    ----------
+    order : numpy.ndarray
+        Path to improve, as indices into `costs`. Its first entry stays first.
+    costs : numpy.ndarray
+        Symmetric matrix of the costs between any two nodes.
+    max_iterations : int, optional
+        Maximum number of reversals.
+    """
+    order = order.copy()
+    n = len(order)
+    if n < 4:
+        return order
+    for _ in range(max_iterations):
+        # reversing order[i:k + 1] replaces the edges (i - 1, i) and
+        # (k, k + 1) with (i - 1, k) and (i, k + 1)
+        prev = order[:-1]  # nodes at i - 1, for i in 1..n-1
+        first = order[1:]  # nodes at i
+        last = order[1:]  # nodes at k, for k in 1..n-1
+        after = np.append(order[2:], -1)  # nodes at k + 1, -1 at the end
+        has_after = after >= 0
+        after = np.where(has_after, after, 0)
+
+        removed = (
+            costs[prev, first][:, None]
+            + np.where(has_after, costs[last, after], 0)[None, :]
+        )
+        added = costs[prev[:, None], last[None, :]] + np.where(
+            has_after[None, :], costs[first[:, None], after[None, :]], 0
+        )
+        delta = np.triu(added - removed, k=1)
+        i, k = np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[i, k] >= -1e-9:
+            break
+        order[i + 1 : k + 2] = order[i + 1 : k + 2][::-1]
+    return order
+
+
+def optimize_order(
+    ra,
+    dec,
+    filters,
+    start=None,
+    slew_rate=2.0,
+    filter_change_time=30.0,
+    two_opt_limit=1000,
+):
+    """Order observations to minimize the total slew and filter change time.
+
+    The path is first built with a nearest neighbour pass, then refined
+    with 2-opt when there are at most `two_opt_limit` observations (2-opt
+    needs the full cost matrix).
+
+    Parameters
+    ----------
+    ra, dec : array-like
+        Coordinates of the observations, in degrees.
+    filters : array-like
+        Filters of the observations.
+    start : tuple of float, optional
+        (RA, Dec) in degrees where the telescope points before the first
+        observation, e.g. the zenith. If None, the path starts with the
+        first observation.
+    slew_rate : float, optional
+        Slew rate of the telescope, in degrees per second.
+    filter_change_time : float, optional
+        Time to change filters, in seconds.
+    two_opt_limit : int, optional
+        Maximum number of observations to refine with 2-opt.
+
+    Returns
+    -------
+    order : numpy.ndarray
+        Indices of the observations, in the order they should be observed.
+    overhead_before : float
+        Overhead in seconds of observing in the original order.
+    overhead_after : float
+        Overhead in seconds of observing in the optimized order.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    filters = np.asarray(filters, dtype=object)
+    n = len(ra)
+    if n == 0:
+        return np.arange(0), 0.0, 0.0
+
+    # the starting position is node 0, followed by the observations
+    if start is not None:
+        ra = np.concatenate([[start[0]], ra])
+        dec = np.concatenate([[start[1]], dec])
+        filters = np.concatenate([np.array([None], dtype=object), filters])
+    offset = 1 if start is not None else 0
+
+    args = (ra, dec, filters, slew_rate, filter_change_time)
+    overhead_before = path_overhead(np.arange(n + offset), *args)
+
+    order = nearest_neighbour(*args)
+    if len(order) <= two_opt_limit:
+        nodes = np.arange(len(order))
+        costs = transition_costs(
+            ra, dec, filters, nodes[:, None], nodes[None, :], *args[3:]
+        )
+        if start is not None:
+            # no filter change from the starting position
+            costs[0, :] = angular_distance(ra[0], dec[0], ra, dec) / slew_rate
+            costs[:, 0] = costs[0, :]
+        order = two_opt(order, costs)
+
+    overhead_after = path_overhead(order, *args)
+    if overhead_after > overhead_before:
+        order = np.arange(n + offset)
+        overhead_after = overhead_before
+
+    return order[offset:] - offset, overhead_before, overhead_after
+
+
+def simulate_deadlines(arrivals, deadlines, exposures, policy="edf"):
+    """Simulate the plans of a single instrument, to compare scheduling policies.
+
+    With the "fifo" policy, the oldest plan that is still valid is run to
+    completion before looking at the next one. With the "edf" policy, plans
+    that can still be completed in time come first, by increasing slack
+    (time left before the end of their window minus their remaining
+    exposure time), followed by the others. Between two observations, the
+    current plan is preempted by the most urgent one if the latter could
+    not be completed in time after waiting for the current one. In both
+    cases, a plan whose window is over when it is picked is missed.
+
+    Parameters
+    ----------
+    arrivals : array-like
+        Time at which each plan is submitted, in seconds.
+    deadlines : array-like
+        End of the validity window of each plan, in seconds.
+    exposures : list of array-like
+        Exposure times of the observations of each plan, in seconds.
+    policy : str, optional
+        Either "fifo" or "edf".
+
+    Returns
+    -------
+    numpy.ndarray
+        Whether each plan was completed before the end of its window.
+    """
+    arrivals = np.asarray(arrivals, dtype=float)
+    deadlines = np.asarray(deadlines, dtype=float)
+    exposures = [list(e) for e in exposures]
+    n = len(arrivals)
+    remaining = np.array([float(np.sum(e)) for e in exposures])
+    next_observation = np.zeros(n, dtype=int)
+    finished = np.array([len(e) == 0 for e in exposures])
+    completed = finished & (arrivals <= deadlines)
+    t = 0.0
+    current = None
+    while not finished.all():
+        ready = ~finished & (arrivals <= t)
+        # plans whose window is over are missed
+        missed = ready & (deadlines < t)
+        finished |= missed
+        ready &= ~missed
+        if current is not None and finished[current]:
+            current = None
+        if not ready.any():
+            if finished.all():
+                break
+            t = max(t, arrivals[~finished].min())
+            continue
+
+        if policy == "fifo":
+            if current is None:
+                candidates = np.flatnonzero(ready)
+                current = candidates[np.argmin(arrivals[candidates])]
+        elif policy == "edf":
+            candidates = np.flatnonzero(ready)
+            slack = deadlines[candidates] - t - remaining[candidates]
+            best = np.lexsort((slack, slack < 0))[0]
+            if current is None or 0 <= slack[best] < remaining[current]:
+                current = candidates[best]
+        else:
+            raise ValueError(f"Unknown scheduling policy {policy}")
+
+        exposure = exposures[current][next_observation[current]]
+        t += exposure
+        remaining[current] -= exposure
+        next_observation[current] += 1
+        if next_observation[current] == len(exposures[current]):
+            finished[current] = True
+            completed[current] = t <= deadlines[current]
+    return completed
@@ -0,0 +1,125 @@
+"""
+Append-only spool of JSON records: writers append one line per record,
+made durable with fsync, and a single reader consumes them in order,
+remembering how far it got in an offset file.
+"""
+
+import fcntl
+import json
+import os
+
+from skyportal_mma_facility.utils.json_util import dumps
+
+
+def _append(path, data):
+    """Append `data` to the file at `path` in a single write, and fsync it.
+
+    The file is locked while writing, so that the lines of concurrent
+    writers, in other threads or processes, never interleave, but not
+    while syncing, so that concurrent fsyncs can be merged by the system.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[os.write(fd, view) :]
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Spool:
+    """A spool file, at `path`, with its offset file and its file of
+    rejected records next to it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.rejected_path = f"{path}.rejected"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def append(self, record):
+        """Append a record, and return once it is on disk."""
+        _append(self.path, dumps(record) + b"\n")
+
+    def offset(self):
+        """Return the position of the first record not consumed yet."""
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def read(self, limit):
+        """Return up to `limit` lines after the offset, as bytes, and the
+        offset after them. A line still being written is left for later."""
+        offset = self.offset()
+        lines = []
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return lines, offset
+        with f:
+            # e.g. the spool was truncated, but the offset was not reset
+            if offset > os.fstat(f.fileno()).st_size:
+                offset = 0
+            f.seek(offset)
+            while len(lines) < limit:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                lines.append(line)
+                offset += len(line)
+        return lines, offset
+
+    def commit(self, offset):
+        """Record that the records before `offset` were consumed."""
+        tmp = f"{self.offset_path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+
+    def truncate(self, max_size):
+        """Empty the spool if it was entirely consumed and is larger than
+        `max_size` bytes. Returns whether it was emptied."""
+        try:
+            fd = os.open(self.path, os.O_WRONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            # no record can be appended in between
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            size = os.fstat(fd).st_size
+            if size <= max_size or self.offset() != size:
+                return False
+            # reset the offset first: after a crash in between, the records
+            # are consumed again, rather than the records appended to the
+            # emptied spool being skipped up to the old offset
+            self.commit(0)
+            os.ftruncate(fd, 0)
+            os.fsync(fd)
+            return True
+        finally:
+            os.close(fd)
+
+    def reject(self, record, error):
+        """Set a record aside, with the reason it could not be consumed."""
+        _append(self.rejected_path, dumps({**record, "error": error}) + b"\n")
+
+    def rejected(self, key, value):
+        """Return the rejected record whose `key` is `value`, if any."""
+        try:
+            with open(self.rejected_path, "rb") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record.get(key) == value:
+                        return record
+        except FileNotFoundError:
+            pass
+        return None
@@ -0,0 +1,284 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import sqlalchemy as sa
+from tornado.httpclient import AsyncHTTPClient
+
+from skyportal_mma_facility.models import (
+    Observation,
+    ObservationPlan,
+    Webhook,
+    utcnow,
+)
+from skyportal_mma_facility.utils.env import load_env
+from skyportal_mma_facility.utils.log import make_log
+from skyportal_mma_facility.utils.model_util import run_in_db_thread
+from skyportal_mma_facility.utils.notifications import (
+    Listener,
+    WEBHOOK_CHANNEL,
+    notify,
+)
+
+env, cfg = load_env()
+
+log = make_log("webhooks")
+
+# the notifications are posted to the `callback_url` of the plan's payload,
+# or to this URL if the plan has none, and not sent at all if neither is set
+default_url = cfg.get("webhooks.url", None)
+
+# new notifications wake the service up, so polling the database is only
+# a fallback in case a notification is ever missed
+poll_interval = cfg.get("webhooks.poll_interval", 60)
+
+# number of notifications posted to a destination in a single request
+batch_size = cfg.get("webhooks.batch_size", 100)
+
+# number of destinations posted to at the same time; a slow destination
+# only holds up its own notifications
+max_clients = cfg.get("webhooks.max_clients", 10)
+request_timeout = cfg.get("webhooks.timeout", 10)
+
+# a failed delivery is retried after `backoff` seconds, doubled after each
+# new failure up to `max_backoff`, and given up after `max_attempts`
+backoff = cfg.get("webhooks.backoff", 5)
+max_backoff = cfg.get("webhooks.max_backoff", 3600)
+max_attempts = cfg.get("webhooks.max_attempts", 10)
+
+# several services can run side by side: the notifications being sent are
+# leased to one of them, a batch at a time, and can be sent by another one
+# once the lease expires, which must not happen before the request is over
+lease_duration = timedelta(
+    seconds=cfg.get("webhooks.lease_duration", 3 * request_timeout)
+)
+
+db_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webhooks-db")
+
+
+def enqueue_webhook(session, observation_id):
+    """Add a notification of the status of an observation to the outbox of
+    its plan's requester, within the session's transaction, so that it is
+    sent if and only if the change it notifies is committed.
+
+    The notification is built and written by a single INSERT ... SELECT,
+    and nothing is written if the plan has no destination.
+    """
+    url = sa.func.coalesce(
+        ObservationPlan.payload["callback_url"].astext,
+        sa.literal(default_url, sa.String),
+    )
+    payload = sa.func.jsonb_build_object(
+        "observation_id",
+        Observation.id,
+        "observation_plan_id",
+        ObservationPlan.id,
+        "queue_name",
+        ObservationPlan.queue_name,
+        "request_id",
+        Observation.request_id,
+        "field_id",
+        Observation.field_id,
+        "status",
+        Observation.status,
+        "date",
+        Observation.date,
+    )
+    result = session.execute(
+        sa.insert(Webhook).from_select(
+            ["url", "payload", "observation_plan_id"],
+            sa.select(url, payload, ObservationPlan.id)
+            .join(Observation, Observation.observation_plan_id == ObservationPlan.id)
+            .where((Observation.id == observation_id) & url.isnot(None)),
+        )
+    )
+    if result.rowcount > 0:
+        notify(session, WEBHOOK_CHANNEL)
+
+
+def lease_webhooks(session, limit, exclude):
+    """Lease up to `limit` of the notifications due, but at most
+    `batch_size` per destination, except those to the URLs in `exclude`,
+    and return them as `(id, url, payload)` rows, with the number of
+    seconds until the next one (but those to `exclude`) is due, or None if
+    there is none left.
+
+    A lease only has to last for a single request to its destination, the
+    next batch being leased once it is done.
+    """
+    due = (
+        sa.select(Webhook.id, Webhook.url, Webhook.next_attempt_at)
+        .where(
+            (Webhook.status == "pending")
+            & (Webhook.next_attempt_at <= utcnow)
+            & Webhook.url.notin_(exclude)
+        )
+        .order_by(Webhook.next_attempt_at, Webhook.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .subquery()
+    )
+    # window functions cannot be used with FOR UPDATE, hence the nesting
+    ranked = sa.select(
+        due.c.id,
+        sa.func.row_number()
+        .over(partition_by=due.c.url, order_by=(due.c.next_attempt_at, due.c.id))
+        .label("rank"),
+    ).subquery()
+    webhook_ids = (
+        sa.select(ranked.c.id).where(ranked.c.rank <= batch_size).scalar_subquery()
+    )
+    rows = session.execute(
+        sa.update(Webhook)
+        .where(Webhook.id.in_(webhook_ids))
+        .values(next_attempt_at=utcnow + lease_duration)
+        .returning(Webhook.id, Webhook.url, Webhook.payload)
+        .execution_options(synchronize_session=False)
+    ).all()
+    next_due = session.scalar(
+        sa.select(
+            sa.func.min(sa.extract("epoch", Webhook.next_attempt_at - utcnow))
+        ).where((Webhook.status == "pending") & Webhook.url.notin_(exclude))
+    )
+    session.commit()
+    return rows, float(next_due) if next_due is not None else None
+
+
+def mark_sent(session, webhook_ids):
+    session.execute(
+        sa.update(Webhook)
+        .where(Webhook.id.in_(webhook_ids))
+        .values(status="sent", attempts=Webhook.attempts + 1, sent_at=utcnow)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+
+def mark_failed(session, webhook_ids, error):
+    """Schedule the next attempt of failed deliveries, with an exponential
+    backoff, or give them up if they were attempted too many times.
+
+    All the notifications of a batch fail together and get the same
+    delay, so that they are retried as a batch as well.
+    """
+    delay = sa.func.least(backoff * sa.func.power(2, Webhook.attempts), max_backoff)
+    session.execute(
+        sa.update(Webhook)
+        .where(Webhook.id.in_(webhook_ids))
+        .values(
+            status=sa.case(
+                (Webhook.attempts + 1 >= max_attempts, "failed"), else_="pending"
+            ),
+            attempts=Webhook.attempts + 1,
+            last_error=error,
+            next_attempt_at=utcnow + sa.func.make_interval(0, 0, 0, 0, 0, 0, delay),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+
+class WebhookDeliverer:
+    """Post the notifications of the outbox to their destinations.
+
+    The notifications due are leased in bulk, grouped by destination, and
+    posted `batch_size` at a time as `{"observations": [...]}`, each with the
+    `id` of its notification so that the destination can ignore the ones
+    it already got. A single batch is leased per destination at a time,
+    so that the lease does not expire while the batches before it are
+    being posted. Each destination is served by its own task, so that
+    a slow or unavailable destination does not delay the others, and the
+    observing loop never waits for any of them: it only writes to the
+    outbox.
+    """
+
+    def __init__(self):
+        self.client = AsyncHTTPClient(max_clients=max_clients)
+        # destinations being posted to, with their tasks
+        self.deliveries = {}
+        self._wake_up = asyncio.Event()
+
+    def on_notification(self, channel, payload):
+        self._wake_up.set()
+
+    async def post(self, url, rows):
+        """Post a batch of notifications to `url`, and return None if they
+        were delivered, or the error otherwise."""
+        body = json.dumps(
+            {"observations": [{"id": id, **payload} for id, _, payload in rows]}
+        )
+        try:
+            response = await self.client.fetch(
+                url,
+                method="POST",
+                body=body,
+                headers={"Content-Type": "application/json"},
+                request_timeout=request_timeout,
+                raise_error=False,
+            )
+        except Exception as e:
+            return str(e)
+        if response.code >= 300:
+            return f"HTTP {response.code}: {response.reason}"
+        return None
+
+    async def deliver(self, url, rows):
+        ids = [row[0] for row in rows]
+        error = await self.post(url, rows)
+        try:
+            if error is None:
+                await run_in_db_thread(db_executor, mark_sent, ids)
+            else:
+                log(f"Could not send {len(ids)} notification(s) to {url}: {error}")
+                await run_in_db_thread(db_executor, mark_failed, ids, error)
+        except Exception as e:
+            # the lease expires, and the batch is sent again later
+            log(f"Error recording the delivery to {url}: {e}")
+
+    def done(self, url, task):
+        self.deliveries.pop(url, None)
+        if not task.cancelled() and task.exception() is not None:
+            log(f"Error delivering to {url}: {task.exception()}")
+        # a destination is free again, look for its next notifications
+        self._wake_up.set()
+
+    async def service(self):
+        while True:
+            self._wake_up.clear()
+            next_due = None
+            free = max_clients - len(self.deliveries)
+            if free > 0:
+                try:
+                    rows, next_due = await run_in_db_thread(
+                        db_executor,
+                        lease_webhooks,
+                        free * batch_size,
+                        list(self.deliveries),
+                    )
+                except Exception as e:
+                    log(f"Error leasing notifications: {e}")
+                    rows = []
+
+                destinations = {}
+                for row in rows:
+                    destinations.setdefault(row[1], []).append(row)
+                for url, rows in destinations.items():
+                    task = asyncio.create_task(self.deliver(url, rows))
+                    task.add_done_callback(lambda task, url=url: self.done(url, task))
+                    self.deliveries[url] = task
+
+            timeout = poll_interval
+            if next_due is not None:
+                timeout = min(poll_interval, max(next_due, 0))
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, engine):
+        """Start delivering in the current event loop, listening for new
+        notifications on `engine`'s database."""
+        self.listener = Listener(engine, [WEBHOOK_CHANNEL], self.on_notification)
+        self.listener.start()
+        self.task = asyncio.create_task(self.service())